@@ -2,7 +2,11 @@ import os
 from dotenv import load_dotenv
 from flask import Flask
 from flask_login import LoginManager
-from utils.mongodb import create_admin_user
+from utils.mongodb import create_admin_user, ensure_indexes
+from utils.auth_cache import get_auth_cache
+from utils.occupancy import get_occupancy
+from utils.gate_mqtt import get_gate_controller
+from utils.session_user import load_user_doc
 from models import User
 
 load_dotenv()
@@ -19,6 +23,11 @@ login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
 create_admin_user()
+ensure_indexes()
+# Warm the gate authorization cache
+get_auth_cache()
+# Reconcile the occupancy counters now and periodically
+get_occupancy()
 
 # Import blueprints
 from routes.auth import auth_blueprint
@@ -38,14 +47,20 @@ app.register_blueprint(outimage_blueprint, url_prefix='/outimage')
 app.register_blueprint(line_blueprint, url_prefix='/line')
 app.register_blueprint(line_auth_blueprint, url_prefix='/line_auth')
 
+# Connect to the gates once the blueprints have routed their MQTT topics
+get_gate_controller()
+# Occupancy snapshots are retained on the broker for signage
+get_occupancy().set_publisher(lambda topic, payload: get_gate_controller().publish(topic, payload, qos=1, retain=True))
+
 # Create the admin user if it doesn't exist
 create_admin_user()
 
 # Define user_loader function for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    """Load a user from the database by their user_id."""
-    return User.get_user_by_id(user_id)
+    """Load the logged-in user, from the user cache or the session snapshot when possible."""
+    user_data = load_user_doc(user_id)
+    return User(user_data) if user_data else None
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, HiddenField, SubmitField, BooleanField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Length, InputRequired, Optional
 from wtforms import IntegerField
@@ -46,4 +47,13 @@ class AddPlateForm(FlaskForm):
         DataRequired(),
         Length(min=1, max=20, message="Plate number must be between 1 and 20 characters.")
     ])
-    submit = SubmitField('Add Plate')
\ No newline at end of file
+    submit = SubmitField('Add Plate')
+
+# Bulk User Import Form
+class ImportUsersForm(FlaskForm):
+    file = FileField('Users File (CSV or JSON)', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'json'], "Upload a .csv or .json file.")
+    ])
+    ordered = BooleanField('Stop at the first error')
+    submit = SubmitField('Import Users')
@@ -10,14 +10,13 @@ from utils.mongodb import (
     mongo_license_plate_find_plate,
     mongo_license_plate_insert, 
     mongo_license_plate_delete,
-    mongo_license_plate_update_status,
+    mongo_gate_transition,
     mongo_user_create, 
     mongo_user_find_line, 
     update_user_by_id,
-    mongo_parking_inbound,
-    mongo_parking_outbound,
-    get_users_with_license_plates,
-    get_plates_with_user_data
+    dashboard_users_page,
+    dashboard_plates_page,
+    mongo_sync_user_plates
     )
 
 # Configure logging
@@ -69,11 +68,11 @@ class User(UserMixin):
     def get_user_by_line_id(cls, line_id):
         """Get a user by their LINE ID."""
         try:
-            logger.info(f"Attempting to fetch user by LINE ID: {line_id}")
-            # Query the database for a user with the given LINE ID
+            logger.debug(f"Attempting to fetch user by LINE ID: {line_id}")
+            # Query the database (or the LINE user cache) for a user with the given LINE ID
             user_data = mongo_user_find_line(line_id)
             if user_data:
-                logger.info(f"User with LINE ID '{line_id}' found in database.")
+                logger.debug(f"User with LINE ID '{line_id}' found.")
                 return cls(user_data)
             logger.warning(f"User with LINE ID '{line_id}' not found in database.")
         except Exception as e:
@@ -153,6 +152,15 @@ class User(UserMixin):
             logger.error(f"Error removing license plate '{plate_number}': {e}")
             return f"Error removing license plate '{plate_number}': {e}"
 
+    def sync_plates(self, plates):
+        """Make the user's license plates match `plates`, writing only the difference."""
+        try:
+            logger.info(f"Syncing license plates of user '{self.username}': {plates}")
+            return mongo_sync_user_plates(self.id, plates)
+        except Exception as e:
+            logger.error(f"Error syncing license plates of user '{self.username}': {e}")
+            return {'added': [], 'removed': [], 'errors': [{'plate': None, 'error': str(e)}]}
+
     def get_id(self):
         logger.debug(f"Returning ID for user '{self.username}': {self.id}")
         return self.id  # Return self.id for Flask-Login compatibility
@@ -211,41 +219,9 @@ class User(UserMixin):
             return False
 
 
-    def minus_limit(self):
-        """Decrease the user's limit by 1."""
-        try:
-            if self.limit > 0:
-                self.limit -= 1
-                self.update_user()
-                logger.info(f"User '{self.username}' limit decreased. New limit: {self.limit}")
-                return True
-            else:
-                logger.warning(f"User '{self.username}' limit is already at 0.")
-                return False
-        except Exception as e:
-            logger.error(f"Error decreasing user '{self.username}' limit: {e}")
-            return False
-    
-    def plus_limit(self):
-        """Increase the user's limit by 1."""
-        try:
-            self.limit += 1
-            self.update_user()
-            logger.info(f"User '{self.username}' limit increased. New limit: {self.limit}")
-            return True
-        except Exception as e:
-            logger.error(f"Error increasing user '{self.username}' limit: {e}")
-            return False
-
-    def get_users_with_license_plates():
-        """Retrieve all users with their associated license plates."""
-        try:
-            users_with_plates = get_users_with_license_plates()
-            logger.info(f"Retrieved {len(users_with_plates)} users with license plates.")
-            return users_with_plates
-        except Exception as e:
-            logger.error(f"Error retrieving users with license plates: {e}")
-            return []
+    def get_users_with_license_plates(**query):
+        """Retrieve one dashboard page of users with their license plates, as a lazily read CursorPage."""
+        return dashboard_users_page(**query)
 
 class LicensePlate:
     def __init__(self, plate_data):
@@ -332,65 +308,16 @@ class LicensePlate:
             'status': self.status,
         }
     
-    def set_status(self, status):
-        """Set the status of the license plate."""
-        try:
-            # Check if the status is already set
-            if self.status == status:
-                logger.info(f"Status of license plate '{self.plate}' is already {status}.")
-                return False  # No change needed, return False
-
-            # Get the user associated with the license plate
-            user = User.get_user_by_id(self.user_id)
-            if not user:
-                logger.error(f"User associated with license plate '{self.plate}' not found.")
-                return False  # Return False if no user found
-
-            logger.info(f"Updating status for license plate '{self.plate}' to {status}.")
-            logger.info(f"User '{user.username}' current limit: {user.limit}")
-
-            if status:  # Status is being set to True (entry)
-                # Attempt to decrement the user's limit
-                if user.minus_limit():
-                    self.status = status
-                    if not mongo_license_plate_update_status(self.plate, self.status):
-                        logger.error(f"Failed to update status of license plate '{self.plate}'. Reverting limit change.")
-                        user.plus_limit()  # Revert the limit decrement
-                        return False
-                    # Log inbound parking
-                    mongo_parking_inbound(self.plate)
-                    logger.info(f"Status of license plate '{self.plate}' set to {status} for inbound parking.")
-                else:
-                    logger.warning(f"User '{user.username}' has no remaining limit to enter parking.")
-                    return False
-            else:  # Status is being set to False (exit)
-                logger.info(f"User '{user.username}' is exiting parking. Updating limit.")
-                # Attempt to increment the user's limit
-                if user.plus_limit():
-                    self.status = status
-                    if not mongo_license_plate_update_status(self.plate, self.status):
-                        logger.error(f"Failed to update status of license plate '{self.plate}'. Reverting limit change.")
-                        user.minus_limit()  # Revert the limit increment
-                        return False
-                    # Log outbound parking
-                    mongo_parking_outbound(self.plate)
-                    logger.info(f"Status of license plate '{self.plate}' set to {status} for outbound parking.")
-                else:
-                    logger.error(f"Failed to update user limit for '{user.username}'.")
-                    return False
-
-            return True  # Successfully updated the status
-
-        except Exception as e:
-            logger.error(f"Error setting status for license plate '{self.plate}': {e}")
-            return False  # Return False on exception
-
-    def get_plates_with_user_data():
-        """Retrieve all license plates with their associated users."""
-        try:
-            plates_with_users = get_plates_with_user_data()
-            logger.info(f"Retrieved {len(plates_with_users)} license plates with users.")
-            return plates_with_users
-        except Exception as e:
-            logger.error(f"Error retrieving license plates with users: {e}")
-            return []
+    @classmethod
+    def gate_transition(cls, plate_number, status, gate=None):
+        """Check a plate in or out atomically at `gate`. Returns (result, LicensePlate, User)."""
+        outcome = mongo_gate_transition(plate_number, status, gate=gate)
+        lp = cls(outcome['plate']) if outcome['plate'] else None
+        user = User(outcome['user']) if outcome['user'] else None
+        if outcome['result'] != 'ok':
+            logger.warning(f"Gate transition for license plate '{plate_number}' to {status} failed: {outcome['result']}")
+        return outcome['result'], lp, user
+
+    def get_plates_with_user_data(**query):
+        """Retrieve one page of license plates with their owners, as a lazily read CursorPage."""
+        return dashboard_plates_page(**query)
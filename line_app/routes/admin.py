@@ -1,13 +1,17 @@
 # routes/admin.py
-from flask import Blueprint, render_template, redirect, url_for, request, jsonify, flash
+from flask import Blueprint, Response, render_template, stream_template, stream_with_context, redirect, url_for, request, jsonify, flash
 from flask_login import login_required, current_user
 from functools import wraps
 from werkzeug.security import generate_password_hash
 from bson import ObjectId
+from datetime import datetime
 import logging
-from forms import EditUserForm, RegisterForm, AddUserForm
+from forms import EditUserForm, RegisterForm, AddUserForm, ImportUsersForm
 from models import User, LicensePlate
-from utils.mongodb import mongo_parking_history
+from utils.table_query import table_args, flag_arg, TABLE_PAGE_SIZE, TABLE_MAX_PAGE_SIZE
+from utils.export import EXPORTS, FORMATS, EXPORT_BATCH_SIZE, export_stream
+from utils.user_import import parse_upload, import_users
+from utils.mongodb import DASHBOARD_USER_SORTS, mongo_parking_history_page, mongo_user_is_admin, invalidate_user, mongo_pool_stats, verify_indexes, explain_hot_queries, to_utc, to_local
 
 # Initialize the Blueprint
 admin_blueprint = Blueprint('admin', __name__)
@@ -18,6 +22,10 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated or not current_user.is_admin:
             return redirect(url_for('auth.login'))  # Redirect to login if not admin
+        # Admin snapshots are short-lived; only writes also re-check the flag, in case another process demoted the user
+        if request.method not in ('GET', 'HEAD') and not mongo_user_is_admin(current_user.id):
+            invalidate_user(current_user.id)
+            return redirect(url_for('auth.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -26,22 +34,90 @@ def admin_required(f):
 @admin_required
 def dashboard():
     try:
-        users = User.get_users_with_license_plates()
-        return render_template('admin_dashboard.html', users=users)
+        query = table_args(request.args, DASHBOARD_USER_SORTS)
+        users = User.get_users_with_license_plates(
+            username_prefix=request.args.get('q', '').strip() or None,
+            is_admin=flag_arg(request.args.get('admin')),
+            **query
+        )
+        args = {key: value for key, value in request.args.items() if key != 'page'}
+        args.setdefault('sort', query['sort'])
+        # Rows are rendered and flushed as they come off the cursor
+        return stream_template('admin_dashboard.html', users=users, page=query['page'], args=args)
     except Exception as e:
         logging.error(f"Error fetching users for dashboard: {e}")
         return jsonify(success=False, error="Failed to fetch users"), 500
 
+def _history_time_arg(name):
+    """Parse a datetime-local query argument, given in the gate timezone, into UTC."""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    return to_utc(datetime.fromisoformat(value))
+
+@admin_blueprint.app_template_filter('local_time')
+def local_time_filter(value, tz_name=None):
+    value = to_local(value, tz_name)
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+@admin_blueprint.app_template_filter('duration')
+def duration_filter(seconds):
+    # Open sessions have no duration yet
+    if not isinstance(seconds, (int, float)):
+        return ''
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+
+def _history_query():
+    """Read the history filters and page arguments from the query string."""
+    return {
+        'limit': max(1, min(request.args.get('limit', TABLE_PAGE_SIZE, type=int), TABLE_MAX_PAGE_SIZE)),
+        'cursor': request.args.get('cursor') or None,
+        'plate_prefix': request.args.get('plate', '').strip() or None,
+        'since': _history_time_arg('since'),
+        'until': _history_time_arg('until'),
+    }
+
 @admin_blueprint.route('/history', methods=['GET'])
 @login_required
 @admin_required
 def history():
     try:
-        history = mongo_parking_history()
-        return render_template('history.html', history= history)
+        query = _history_query()
+        history = mongo_parking_history_page(**query)
+        filters = {key: request.args.get(key, '') for key in ('plate', 'since', 'until')}
+        return stream_template('history.html', history=history, filters=filters, first_page=query['cursor'] is None)
+    except ValueError:
+        flash("Invalid date filter.", "danger")
+        return redirect(url_for('admin.history'))
     except Exception as e:
-        logging.error(f"Error fetching users for dashboard: {e}")
-        return jsonify(success=False, error="Failed to fetch users"), 500
+        logging.error(f"Error fetching parking history: {e}")
+        return jsonify(success=False, error="Failed to fetch parking history"), 500
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+@admin_blueprint.route('/history/data', methods=['GET'])
+@login_required
+@admin_required
+def history_data():
+    """JSON version of the history page for scripts and dashboards."""
+    try:
+        history = mongo_parking_history_page(**_history_query())
+    except ValueError:
+        return jsonify(success=False, error="Invalid date filter"), 400
+    rows = [
+        {
+            'plate': doc.get('plate'),
+            'inbound': _isoformat(to_local(doc.get('inbound'), doc.get('tz'))),
+            'outbound': _isoformat(to_local(doc.get('outbound'), doc.get('tz'))),
+            'duration_s': doc.get('duration_s'),
+        }
+        for doc in history
+    ]
+    return jsonify(success=True, history=rows, next_cursor=history.next_cursor), 200
 
 @admin_blueprint.route('/edit_user/<user_id>', methods=['GET', 'POST'])
 @login_required
@@ -93,24 +169,16 @@ def edit_user(user_id):
             # Update user data in the database
             user.edit_user(user_data)
 
-            # Clear existing license plates and insert new ones
-            current_plates = user.find_plate()
-            for plate in current_plates:
-                LicensePlate.remove_plate(plate.get('plate'))
-
-            for plate in license_plates:
-                plate_data = {
-                    "user_id": user.id,
-                    "plate": plate,
-                    "status": False  # Default status
-                }
-                LicensePlate.add_plate(plate_data)
+            # Add and remove only the plates that changed
+            report = user.sync_plates(license_plates)
+            for error in report['errors']:
+                flash(f"License plate '{error['plate']}': {error['error']}", "danger")
 
             flash(f"User '{username}' updated successfully.", "success")
             return redirect(url_for('admin.dashboard'))
 
         except Exception as e:
-            logger.error(f"Error updating user '{user_id}': {e}")
+            logging.error(f"Error updating user '{user_id}': {e}")
             flash("An error occurred while updating the user. Please try again.", "danger")
 
     # Render the form template
@@ -179,4 +247,61 @@ def add_user():
             logging.error(f"Error creating user: {e}")
             flash("Error creating user. Please try again.", "danger")
 
-    return render_template('add_user.html', form=form)  # Render the form on GET or invalid submission
\ No newline at end of file
+    return render_template('add_user.html', form=form)  # Render the form on GET or invalid submission
+
+@admin_blueprint.route('/import_users', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_users_view():
+    form = ImportUsersForm()
+    reports = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        try:
+            raw_rows = parse_upload(upload.filename, upload.read())
+            reports = import_users(raw_rows, ordered=form.ordered.data)
+            created = sum(1 for report in reports if report['status'] == 'created')
+            flash(f"Imported {created} of {len(reports)} users.", "success" if created == len(reports) else "danger")
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f"Could not read the file: {e}", "danger")
+        except Exception as e:
+            logging.error(f"Error importing users: {e}")
+            flash("Error importing users. Please try again.", "danger")
+        if reports is not None and request.args.get('format') == 'json':
+            return jsonify(success=True, rows=reports), 200
+    return render_template('import_users.html', form=form, reports=reports)
+
+@admin_blueprint.route('/mongo_stats', methods=['GET'])
+@login_required
+@admin_required
+def mongo_stats():
+    return jsonify(mongo_pool_stats()), 200
+
+@admin_blueprint.route('/indexes', methods=['GET'])
+@login_required
+@admin_required
+def indexes():
+    return jsonify(indexes=verify_indexes(), hot_queries=explain_hot_queries()), 200
+
+@admin_blueprint.route('/export/<collection>', methods=['GET'])
+@login_required
+@admin_required
+def export(collection):
+    """Stream a CSV or NDJSON export of parking_history, license_plates or users."""
+    fmt = request.args.get('format', 'csv')
+    if collection not in EXPORTS or fmt not in FORMATS:
+        return jsonify(success=False, error="Unknown export"), 404
+    try:
+        since, until = _history_time_arg('since'), _history_time_arg('until')
+    except ValueError:
+        return jsonify(success=False, error="Invalid date filter"), 400
+    batch_size = max(1, request.args.get('batch_size', EXPORT_BATCH_SIZE, type=int))
+    gzip = request.args.get('gzip') in ('1', 'true', 'yes')
+
+    filename = f"{collection}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}" + ('.gz' if gzip else '')
+    stream = export_stream(collection, fmt, since, until, batch_size, gzip)
+    return Response(
+        stream_with_context(stream),
+        mimetype='application/gzip' if gzip else FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,188 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import json
+import logging
+from flask import Blueprint, request, jsonify, url_for
+from flask_login import login_required
+from models import LicensePlate
+from routes.admin import admin_required
+from routes.line import push_message, notifier
+from utils.ai import get_recognizer, lpr_cache
+from utils.frame_queue import get_frame_queue, new_frame, frame_results
+from utils.frame_archive import archive_frame, get_frame_archiver
+from utils.frame_dedupe import frame_dedupe, dhash
+from utils.gate_session import gate_sessions, SessionClosed
+from utils.auth_cache import get_auth_cache
+from utils.occupancy import get_occupancy
+from utils.gate_mqtt import get_gate_controller, gate_topic, route
+
+logger = logging.getLogger()
+
+# Seconds an upload may wait for its outcome when the caller does not pass ?wait=
+INGEST_WAIT = float(os.getenv("INGEST_WAIT", 0))
+# Longest ?wait= honoured, matching the camera firmware's upload timeout
+INGEST_WAIT_MAX = float(os.getenv("INGEST_WAIT_MAX", 5))
+
+def create_gate_blueprint(name, gate, check_in, barrier_topic=None):
+    """
+    Build the frame upload pipeline of one gate as a blueprint.
+
+    Args:
+        name (str): Blueprint name ('inimage', 'outimage').
+        gate (str): Gate id, also the root of its MQTT topics ('inbound/gate1').
+        check_in (bool): True if a recognized plate is checked in, False if checked out.
+        barrier_topic (str): Topic opening the barrier, `/<gate>/barrier` by default.
+    """
+    blueprint = Blueprint(name, __name__)
+    image_dir = f"./images/{gate}"
+    os.makedirs(image_dir, exist_ok=True)
+    result_topic = gate_topic(gate, "result")
+    barrier_topic = barrier_topic or gate_topic(gate, "barrier")
+    action = "checked in" if check_in else "checked out"
+
+    def on_gate_message(topic, payload):
+        if payload == "enable":
+            # A new car: start a new session and drop frames left over from the previous one
+            session = gate_sessions.rotate(gate)
+            frame_queue().discard(lambda frame: frame['session'] != session)
+
+    # Only this gate's control topic reaches the handler; the barrier and result topics are ours to publish
+    route(gate_topic(gate), on_gate_message)
+
+    def check_lp(frame):
+        try:
+            # Analyze the image on the warm recognizer pool, abandoning it if the session is decided meanwhile
+            plates = gate_sessions.run(gate, frame['session'], get_recognizer().submit(frame['data']))
+            if not plates or not plates[0]['plate']:
+                return {"error": "No license plate detected in the image."}, 400
+            plate_number = plates[0]['plate']
+
+            # Frames of a session that was decided while this one was recognized must not act on the gate
+            if not gate_sessions.is_open(gate, frame['session']):
+                raise SessionClosed(f"Session {frame['session']} of gate '{gate}' is closed.")
+
+            # Reject unknown plates, repeated transitions and exhausted limits from the cache
+            auth_cache = get_auth_cache()
+            verdict = auth_cache.precheck(plate_number, check_in)
+            if verdict == 'not_found':
+                return {"error": f"License plate '{plate_number}' not found in the database."}, 404
+            if verdict != 'ok':
+                return {"error": f"Failed to update license plate status ({verdict})."}, 409
+
+            # Flip the plate, the owner's limit and the parking history in one step
+            result, lp, user = LicensePlate.gate_transition(plate_number, check_in, gate=gate)
+            if result == 'not_found':
+                return {"error": f"License plate '{plate_number}' not found in the database."}, 404
+            if result != 'ok':
+                return {"error": f"Failed to update license plate status ({result})."}, 409 if result != 'error' else 500
+            auth_cache.apply_transition(lp, user)
+
+            gate_sessions.decide(gate, frame['session'])
+            frame_queue().discard(lambda queued: queued['session'] == frame['session'])
+            get_gate_controller().publish(barrier_topic, "detected")
+            get_gate_controller().publish(gate_topic(gate), "disable")
+            get_occupancy().changed()
+            # Queued for the LINE notifier; the gate never waits on the LINE API
+            if user.line:
+                push_message(user.line, f"Your car with license plate {plate_number} has been {action}.")
+            return {
+                "message": "License plate detected and updated successfully.",
+                "plate_number": plate_number
+            }, 200
+
+        except SessionClosed as e:
+            return {"error": f"Frame discarded: {e}"}, 409
+
+        except RuntimeError as e:
+            return {"error": f"Error recognizing license plate: {e}"}, 500
+
+        except Exception as e:
+            return {"error": f"Unexpected error: {str(e)}"}, 500
+
+    def decide_frame(frame):
+        if not gate_sessions.is_open(gate, frame['session']):
+            return {"error": "Frame discarded: gate session already decided."}, 409
+        digest = dhash(frame['data'])
+        if frame_dedupe.is_duplicate(gate, frame['session'], digest):
+            return {"message": "Frame skipped: too similar to the last analyzed frame."}, 200
+        body, status = check_lp(frame)
+        if status != 500:
+            frame_dedupe.remember(gate, frame['session'], digest)
+        return body, status
+
+    def process_frame(frame):
+        """Run the check-in or check-out pipeline for a queued frame."""
+        body, status = decide_frame(frame)
+        logger.info(f"Gate '{gate}' frame {frame['id']}: {status} {body}")
+        return body, status
+
+    def publish_result(frame, state, status, body):
+        # Every outcome reaches the result topic: decided, skipped, failed, dropped or discarded frames
+        get_gate_controller().publish(result_topic, json.dumps({"frame_id": frame['id'], "state": state, "status": status, **(body or {})}))
+
+    def frame_queue():
+        return get_frame_queue(gate, process_frame, on_result=publish_result)
+
+    @blueprint.route("/video", methods=["POST"])
+    def receive_frame():
+        if 'file' not in request.files:
+            return jsonify({"error": "No file part"}), 400
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({"error": "No selected file"}), 400
+        try:
+            data = file.read()
+            if not data:
+                return jsonify({"error": "Empty image file"}), 400
+            session = gate_sessions.current(gate)
+            if not gate_sessions.is_open(gate, session):
+                return jsonify({"message": "Gate session already decided; frame discarded."}), 200
+            frame = new_frame(gate, data=data, session=session)
+            archive_frame(image_dir, frame['session'], data, frame['received_at'])
+            depth = frame_queue().put(frame)
+            wait = min(request.args.get('wait', INGEST_WAIT, type=float), INGEST_WAIT_MAX)
+            if wait > 0:
+                result = frame_results.wait(frame['id'], wait)
+                if result and result['state'] in ('done', 'dropped', 'discarded'):
+                    # Dropped and discarded frames were superseded before they were analyzed
+                    status = result['status'] or 409
+                    return jsonify({"frame_id": frame['id'], "state": result['state'], "status": status, **(result['result'] or {})}), status
+            return jsonify({
+                "message": "Frame queued.",
+                "frame_id": frame['id'],
+                "queue_depth": depth,
+                "result_url": url_for(f'{name}.frame_result', frame_id=frame['id']),
+                "result_topic": result_topic
+            }), 202
+        except Exception as e:
+            return jsonify({"error": f"Error processing frame: {e}"}), 500
+
+    @blueprint.route("/stats", methods=["GET"])
+    @login_required
+    @admin_required
+    def stats():
+        return jsonify({
+            **frame_queue().stats(),
+            "dedupe": frame_dedupe.stats(gate),
+            "archive": get_frame_archiver().stats(),
+            "session": gate_sessions.stats(gate),
+            "lpr_cache": lpr_cache.stats(),
+            "auth_cache": get_auth_cache().stats(),
+            "occupancy": get_occupancy().stats(),
+            "notifications": notifier.stats(),
+            "mqtt": get_gate_controller().stats()
+        }), 200
+
+    # Polled by the cameras, which upload without a login like `/video`: the random
+    # frame id is the credential, and a result holds no more than the upload's own reply
+    @blueprint.route("/result/<frame_id>", methods=["GET"])
+    def frame_result(frame_id):
+        result = frame_results.get(frame_id)
+        if result is None:
+            return jsonify({"error": f"Frame '{frame_id}' not found."}), 404
+        return jsonify(result), 200
+
+    return blueprint
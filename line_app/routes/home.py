@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, jsonify, flash
+from flask import Blueprint, stream_template, request, redirect, url_for, jsonify, flash
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 from forms import EditUserForm
 from forms import AddPlateForm
-from models import User, LicensePlate
+from models import LicensePlate
+from utils.occupancy import get_occupancy
+from utils.table_query import table_args, flag_arg
+from utils.mongodb import DASHBOARD_PLATE_SORTS
 
 home_blueprint = Blueprint('home', __name__)
 
@@ -12,7 +15,8 @@ home_blueprint = Blueprint('home', __name__)
 @login_required
 def index():
     form = AddPlateForm()
-    user = User.get_user_by_id(current_user.id)
+    # The logged-in user comes from the user loader's cache; plates are looked up by id
+    user = current_user
 
     # Handle adding a license plate
     if form.validate_on_submit():
@@ -24,22 +28,41 @@ def index():
         return redirect(url_for('home.index'))
 
     admin = user.is_admin
+    page, args = 1, {}
     if not admin:
         license_plates = user.find_plate()
     else:
-        license_plates = LicensePlate.get_plates_with_user_data()
+        query = table_args(request.args, DASHBOARD_PLATE_SORTS)
+        license_plates = LicensePlate.get_plates_with_user_data(
+            plate_prefix=request.args.get('q', '').strip() or None,
+            status=flag_arg(request.args.get('status')),
+            **query
+        )
+        page = query['page']
+        args = {key: value for key, value in request.args.items() if key != 'page'}
+        args.setdefault('sort', query['sort'])
 
-    return render_template('home.html', user=user, license_plates=license_plates, form=form, admin=admin)
+    # The admin table is rendered and flushed as it comes off the cursor
+    return stream_template('home.html', user=user, license_plates=license_plates, form=form, admin=admin,
+                           page=page, args=args)
 
 # Route to handle plate deletion
 @home_blueprint.route('/delete_plate/<plate>', methods=['POST'])
 @login_required
 def delete_plate(plate):
-    user = User.get_user_by_id(current_user.id)
+    user = current_user
     if user.is_admin:
         user.remove_plate(plate_number=plate)
     if user.remove_plate(plate):
         flash(f"License plate '{plate}' deleted successfully.", "success")
     else:
         flash(f"Failed to delete license plate '{plate}'. It might not exist.", "danger")
-    return redirect(url_for('home.index'))
\ No newline at end of file
+    return redirect(url_for('home.index'))
+
+# Live occupancy for signage and dashboards, served from the counters
+@home_blueprint.route('/occupancy', methods=['GET'])
+def occupancy():
+    try:
+        return jsonify(get_occupancy().snapshot()), 200
+    except Exception as e:
+        return jsonify({"error": f"Error reading occupancy: {e}"}), 500
@@ -4,8 +4,12 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from datetime import datetime 
-from flask import request, abort, Blueprint
+from flask import request, abort, Blueprint, jsonify
+from flask_login import login_required
 import json
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from linebot import LineBotApi
 from linebot.exceptions import LineBotApiError
@@ -13,15 +17,11 @@ from linebot.exceptions import LineBotApiError
 from linebot.v3 import (
     WebhookHandler
 )
-from linebot.v3.exceptions import (
-    InvalidSignatureError
-)
 from linebot.v3.messaging import (
     Configuration,
     ApiClient,
     MessagingApi,
     ReplyMessageRequest,
-    PushMessageRequest,
     TextMessage,
     ImageMessage
 )
@@ -31,43 +31,109 @@ from linebot.v3.webhooks import (
 )
 
 from models import User
+from routes.admin import admin_required
+from utils.cache import TTLCache
+from utils.line_notify import LineNotifier
+from utils.mongodb import line_user_cache
+from utils.per_process import per_process
 
 line_blueprint = Blueprint('line', __name__)
 
+logger = logging.getLogger()
+
+# Threads processing webhook events after the callback has been acknowledged
+LINE_WEBHOOK_WORKERS = int(os.getenv('LINE_WEBHOOK_WORKERS', 8))
+# Keep-alive connections held by the shared Messaging API client
+LINE_API_POOL_SIZE = int(os.getenv('LINE_API_POOL_SIZE', 16))
+# LINE profiles (display name and picture) change rarely, so they are kept longer than users
+LINE_PROFILE_CACHE_SIZE = int(os.getenv('LINE_PROFILE_CACHE_SIZE', 1024))
+LINE_PROFILE_CACHE_TTL = float(os.getenv('LINE_PROFILE_CACHE_TTL', 6 * 3600))
+
 configuration = Configuration(access_token=os.environ['CHANNEL_ACCESS_TOKEN'])
+configuration.connection_pool_maxsize = LINE_API_POOL_SIZE
 handler = WebhookHandler(os.environ['CHANNEL_SECRET'])
 line_bot_api = LineBotApi(os.environ['CHANNEL_ACCESS_TOKEN'])
 
+profile_cache = TTLCache(maxsize=LINE_PROFILE_CACHE_SIZE, ttl=LINE_PROFILE_CACHE_TTL)
+webhook_stats = {'received': 0, 'processed': 0, 'failed': 0}
+_webhook_stats_lock = threading.Lock()
+
+def _count_webhook(outcome):
+    # Updated from the request threads and the worker pool at once
+    with _webhook_stats_lock:
+        webhook_stats[outcome] += 1
+
+@per_process
+def get_messaging_api():
+    """Return the process-wide Messaging API client; its connection pool is thread-safe and keeps connections alive."""
+    return MessagingApi(ApiClient(configuration))
+
+@per_process
+def get_webhook_executor():
+    """Return the process-wide pool that processes webhook events."""
+    return ThreadPoolExecutor(max_workers=LINE_WEBHOOK_WORKERS, thread_name_prefix='line-webhook')
+
+# Push notifications are delivered in the background
+notifier = LineNotifier(get_messaging_api)
+
+def reply(event, messages):
+    """Reply to an event with the shared Messaging API client."""
+    get_messaging_api().reply_message_with_http_info(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=messages
+        )
+    )
+
+def process_webhook(body, signature):
+    """Dispatch the events of an acknowledged webhook to their handlers."""
+    try:
+        handler.handle(body, signature)
+        _count_webhook('processed')
+    except Exception as e:
+        _count_webhook('failed')
+        logger.error(f"Error processing LINE webhook: {e}")
+
 @line_blueprint.route("/callback", methods=['POST'])
 def callback():
-    signature = request.headers['X-Line-Signature']
+    signature = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    if not handler.parser.signature_validator.validate(body, signature):
         abort(400)
+    # Acknowledge right away; replies go out from the worker pool
+    _count_webhook('received')
+    get_webhook_executor().submit(process_webhook, body, signature)
     return 'OK'
 
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
     # collect_user_command(event)
-    if not exist_user(event):
+    # Resolve the sender once; the commands below work on this user
+    user = User.get_user_by_line_id(event.source.user_id)
+    if not user:
         if event.message.text == "#create_user":
             reply_text = create_user(event)
         if event.message.text == "#liff":
             command_liff(event)
         else:
             reply_text = "Please register first.\n(type \"#create_user\")"
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=reply_text)]
-                )
-            )
+        reply(event, [TextMessage(text=reply_text)])
     else:
-        create_reply(event)
+        create_reply(event, user)
+
+def get_profile(user_id):
+    """
+    Get a LINE user's display name and picture URL, cached for LINE_PROFILE_CACHE_TTL.
+
+    Raises:
+        LineBotApiError: If the profile cannot be fetched.
+    """
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        result = line_bot_api.get_profile(user_id)
+        profile = {'display_name': result.display_name, 'picture_url': result.picture_url}
+        profile_cache.set(user_id, profile)
+    return profile
 
 def collect_user_command(event):
     user_id = event.source.user_id
@@ -77,9 +143,9 @@ def collect_user_command(event):
     covert_time = datetime.fromtimestamp(timestamp_int/1000)
     format_time = covert_time.strftime('%Y-%m-%d %H:%M:%S')
     try:
-        profile = line_bot_api.get_profile(user_id)
-        display_name = profile.display_name
-        pic_url = profile.picture_url
+        profile = get_profile(user_id)
+        display_name = profile['display_name']
+        pic_url = profile['picture_url']
     except LineBotApiError as e:
         display_name = "Unknown"
         pic_url = None
@@ -93,19 +159,11 @@ def collect_user_command(event):
     }
     # mongo_user_insert(user_data)
 
-def exist_user(event):
-    user_id = event.source.user_id
-    exist = User.get_user_by_line_id(user_id)
-    if exist:
-        return True
-    else:
-        return False
-
 def create_user(event):
     user_id = event.source.user_id
-    profile = line_bot_api.get_profile(user_id)
-    display_name = profile.display_name
-    pic = profile.picture_url
+    profile = get_profile(user_id)
+    display_name = profile['display_name']
+    pic = profile['picture_url']
     userdata = {
         'line': user_id,
         'username': display_name,
@@ -118,32 +176,25 @@ def create_user(event):
 
     return f"user {display_name} created"
 
-def create_reply(event):
+def create_reply(event, user):
     user_message = event.message.text
     if user_message == "#liff":
         command_liff(event)
     elif user_message.startswith("#lp"):
-        command_lp(event)
+        command_lp(event, user)
     elif user_message == "#profile" or user_message == "#create_user":
-        command_profile(event)
+        command_profile(event, user)
     else:
         command_else(event)
 
 def command_else(event):
     user_message = event.message.text
     reply_text = f"You said: {user_message}"
-    with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=reply_text)]
-                )
-            )
-
-def command_profile(event):
+    reply(event, [TextMessage(text=reply_text)])
+
+def command_profile(event, user):
     user_message = event.message.text
-    user_data = User.get_user_by_line_id(event.source.user_id).get_user_data()
+    user_data = user.get_user_data()
     if user_data:
         if user_message == "#create_user":
             reply_text = f"User already created...\n\n"
@@ -155,19 +206,10 @@ def command_profile(event):
     else:
         reply_text = "User profile not found."
 
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[ImageMessage(original_content_url=user_data['pic'], preview_image_url=user_data['pic']),
-                TextMessage(text=reply_text)]
-            )
-        )
+    reply(event, [ImageMessage(original_content_url=user_data['pic'], preview_image_url=user_data['pic']), TextMessage(text=reply_text)])
 
-def command_lp(event):
+def command_lp(event, user):
     user_message = event.message.text
-    user = User.get_user_by_line_id(event.source.user_id)
     user_data = user.get_user_data()
     reply_text = "Invalid command. Use #lp add <plate_number>, #lp remove <plate_number>, or #lp list."  # Default reply text
     
@@ -204,47 +246,38 @@ def command_lp(event):
         reply_text = "User profile not found."
 
     # Send reply
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=reply_text)]
-            )
-        )
+    reply(event, [TextMessage(text=reply_text)])
 
 
 def command_liff(event):
     reply_text = "https://liff.line.me/2006527692-bk9DWq73"
-    with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=reply_text)]
-                )
-            )
+    reply(event, [TextMessage(text=reply_text)])
 
 def push_message(user_id, message):
     """
-    Send a push message to a user via LINE Messaging API.
+    Queue a push message to a user via LINE Messaging API.
+
+    Returns immediately; delivery, retries and coalescing happen on the
+    notifier's workers.
 
     Args:
         user_id (str): The recipient's LINE user ID.
         message (str): The message text to send.
+
+    Returns:
+        bool: False if the notification queue is full and the message was dropped.
     """
-    try:
-        # Configure the LINE Messaging API client
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            
-            # Send the push message
-            response = line_bot_api.push_message_with_http_info(
-                PushMessageRequest(
-                    to=user_id,
-                    messages=[TextMessage(text=message)]
-                )
-            )
-            print(f"Message sent to {user_id}: {message}, Response: {response}")
-    except Exception as e:
-        print(f"Error sending message to {user_id}: {e}")
\ No newline at end of file
+    return notifier.notify(user_id, message)
+
+@line_blueprint.route("/notify_stats", methods=['GET'])
+@login_required
+@admin_required
+def notify_stats():
+    with _webhook_stats_lock:
+        webhooks = dict(webhook_stats)
+    return jsonify({
+        **notifier.stats(),
+        'webhooks': webhooks,
+        'user_cache': line_user_cache.stats(),
+        'profile_cache': profile_cache.stats(),
+    }), 200
@@ -1,36 +1,73 @@
 import os
 import argparse
 import io
-import tempfile
+import hashlib
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from dotenv import load_dotenv
-from aift import setting
-from aift.image.detection import lpr
+from utils.cache import TTLCache
+from utils.lpr_backends import create_backend
+from utils.per_process import per_process
 
-# Load the AI API key from the environment variable
 load_dotenv()
-AI_API_KEY = os.getenv('AI_API_KEY')
 
-# Set the API key for the AI service
-setting.set_api_key(AI_API_KEY)
+# Number of warm recognizer workers kept per process
+LPR_WORKERS = int(os.getenv('LPR_WORKERS', 4))
 
-def preprocess_image(input_path, max_size=(800, 800), quality=85):
+# Preprocessing mode: "quality" (full decode + LANCZOS) or "fast" (JPEG scale-on-decode)
+PREPROCESS_MODE = os.getenv('PREPROCESS_MODE', 'quality')
+
+# LPR result cache keyed by the hash of the preprocessed image
+LPR_CACHE_SIZE = int(os.getenv('LPR_CACHE_SIZE', 1024))
+LPR_CACHE_TTL = float(os.getenv('LPR_CACHE_TTL', 3600))
+LPR_CACHE_MAX_BYTES = int(os.getenv('LPR_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+LPR_CACHE_PATH = os.getenv('LPR_CACHE_PATH') or None
+
+logger = logging.getLogger()
+
+lpr_cache = TTLCache(maxsize=LPR_CACHE_SIZE, ttl=LPR_CACHE_TTL, max_bytes=LPR_CACHE_MAX_BYTES, path=LPR_CACHE_PATH)
+
+def preprocess_image(input_path, max_size=(800, 800), quality=85, mode=None):
     """
     Resize and compress an image in memory.
-    
+
+    Frames that are already JPEGs within `max_size` are returned as-is without
+    being decoded. In "fast" mode JPEGs are decoded straight at a reduced scale
+    (libjpeg DCT scaling) and finished with a bilinear resize, trading a little
+    sharpness for a much cheaper decode.
+
     Args:
-        input_path (str): Path to the input image.
+        input_path (str, bytes or file-like): Path to the input image, its bytes, or a file-like object.
         max_size (tuple): Maximum width and height of the resized image.
         quality (int): Compression quality (1-100).
-    
+        mode (str): "quality" or "fast", defaults to PREPROCESS_MODE.
+
     Returns:
         BytesIO: In-memory bytes object of the preprocessed image.
     """
+    mode = mode or PREPROCESS_MODE
     try:
+        if isinstance(input_path, (bytes, bytearray)):
+            input_path = io.BytesIO(input_path)
         with Image.open(input_path) as img:
-            # Preserve aspect ratio while resizing
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)  # Use LANCZOS for high-quality downscaling
-            
+            # Already small enough: skip the decode/re-encode round trip
+            if img.format == "JPEG" and img.width <= max_size[0] and img.height <= max_size[1]:
+                if isinstance(input_path, io.BytesIO):
+                    return io.BytesIO(input_path.getvalue())
+                img.fp.seek(0)
+                return io.BytesIO(img.fp.read())
+
+            if mode == "fast":
+                # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding
+                scale = min(max_size[0] / img.width, max_size[1] / img.height)
+                img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+                img.thumbnail(max_size, Image.Resampling.BILINEAR, reducing_gap=None)
+            else:
+                # Preserve aspect ratio while resizing
+                img.thumbnail(max_size, Image.Resampling.LANCZOS)  # Use LANCZOS for high-quality downscaling
+
             # Save the preprocessed image to an in-memory buffer
             img_bytes = io.BytesIO()
             img.save(img_bytes, format="JPEG", quality=quality)
@@ -39,55 +76,118 @@ def preprocess_image(input_path, max_size=(800, 800), quality=85):
     except Exception as e:
         raise RuntimeError(f"Error preprocessing image: {e}")
 
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Return the recognizer backend selected by LPR_BACKEND, creating it on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+            logger.info(f"LPR backend '{_backend.name}' initialized.")
+        return _backend
+
 def analyze_image(image_bytes):
     """
-    Analyze the license plate using the AI service.
-    
+    Analyze the license plate using the configured recognizer backend.
+
     Args:
         image_bytes (BytesIO): In-memory image bytes.
-    
+
     Returns:
         list: License plate recognition results.
     """
     try:
-        # Write the image bytes to a temporary file
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=True) as temp_file:
-            temp_file.write(image_bytes.read())
-            temp_file.flush()  # Ensure all data is written
-            # Call the lpr.analyze function with the temporary file path
-            result = lpr.analyze(temp_file.name, crop=1, rotate=1)
-            return result
+        return get_backend().analyze(image_bytes)
     except Exception as e:
         raise RuntimeError(f"Error analyzing image: {e}")
 
-# Set up argparse
-parser = argparse.ArgumentParser(description="Perform license plate recognition on an image.")
-parser.add_argument(
-    "-p",
-    "--path",
-    required=True,
-    type=str,
-    help="Path to the image file for license plate recognition."
-)
-
-# Parse arguments
-args = parser.parse_args()
-
-try:
-    # Preprocess the image in memory
-    preprocessed_image = preprocess_image(args.path)
-    # print(f"Image preprocessed successfully.")
-
-    # Analyze the image
-    result = analyze_image(preprocessed_image)
-
-    # Ensure the result is a list and process it
-    if isinstance(result, list):
-        license_plates = [item.get('lpr', 'Unknown') for item in result if isinstance(item, dict)]
-        for plate in license_plates:
-            print(f"{plate}")
-    else:
-        print("Unexpected result format. Please check the output of lpr.analyze.")
-except Exception as e:
-    print(f"Error processing the image: {e}")
-    exit(1)  # Exit with non-zero status on error
+def parse_result(result):
+    """
+    Convert the raw lpr-v2 response into structured plate results.
+
+    Args:
+        result (list): Raw response returned by `analyze_image`.
+
+    Returns:
+        list: Dicts with `plate`, `confidence` and `bbox` keys, in the order returned by the service.
+    """
+    if not isinstance(result, list):
+        raise RuntimeError(f"Unexpected result format from the LPR backend: {result!r}")
+    plates = []
+    for item in result:
+        if not isinstance(item, dict):
+            continue
+        plates.append({
+            'plate': item.get('lpr', 'Unknown'),
+            'confidence': item.get('conf', item.get('confidence')),
+            'bbox': item.get('bbox'),
+        })
+    return plates
+
+class Recognizer:
+    """Long-lived pool of LPR workers that turns image bytes into plate results."""
+
+    def __init__(self, workers=LPR_WORKERS):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lpr')
+        logger.info(f"LPR recognizer started with {workers} workers.")
+
+    def _recognize(self, image_bytes):
+        preprocessed = preprocess_image(image_bytes)
+        # Retried or reprocessed frames cost a hash instead of a remote call
+        key = hashlib.sha256(preprocessed.getbuffer()).hexdigest()
+        plates = lpr_cache.get(key)
+        if plates is None:
+            plates = parse_result(analyze_image(preprocessed))
+            lpr_cache.set(key, plates)
+        return plates
+
+    def submit(self, image_bytes):
+        """Queue image bytes for recognition and return a Future of the plate results."""
+        return self._executor.submit(self._recognize, image_bytes)
+
+    def recognize(self, image_bytes, timeout=None):
+        """Recognize license plates in image bytes, blocking until the result is ready."""
+        return self.submit(image_bytes).result(timeout=timeout)
+
+    def shutdown(self, wait=True):
+        """Stop accepting work and release the worker pool."""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        logger.info("LPR recognizer stopped.")
+
+@per_process
+def get_recognizer():
+    """Return the process-wide recognizer, starting its worker pool on first use."""
+    return Recognizer()
+
+def main(argv=None):
+    # Run from line_app/ as: python -m utils.ai -p <image>
+    # Set up argparse
+    parser = argparse.ArgumentParser(description="Perform license plate recognition on an image.")
+    parser.add_argument(
+        "-p",
+        "--path",
+        required=True,
+        type=str,
+        help="Path to the image file for license plate recognition."
+    )
+
+    # Parse arguments
+    args = parser.parse_args(argv)
+
+    recognizer = get_recognizer()
+    try:
+        with open(args.path, 'rb') as f:
+            plates = recognizer.recognize(f.read())
+        for plate in plates:
+            print(f"{plate['plate']}")
+    except Exception as e:
+        print(f"Error processing the image: {e}")
+        exit(1)  # Exit with non-zero status on error
+    finally:
+        recognizer.shutdown()
+
+if __name__ == '__main__':
+    main()
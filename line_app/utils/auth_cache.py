@@ -0,0 +1,267 @@
+import os
+import time
+import threading
+import logging
+from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+from utils.mongodb import get_mongo_client, on_write
+from utils.per_process import per_process
+
+load_dotenv()
+
+# Without change streams (standalone MongoDB) a cached plate is read again once it is this old
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', 10))
+# Unknown plates are remembered for this long before the database is asked again
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv('AUTH_CACHE_NEGATIVE_TTL', 30))
+
+logger = logging.getLogger()
+
+PLATE_FIELDS = {'plate': 1, 'user_id': 1, 'status': 1}
+USER_FIELDS = {'username': 1, 'line': 1, 'limit': 1}
+
+class PlateAuthCache:
+    """
+    Process-local copy of the gate working set: plate -> owner -> LINE id, limit and status.
+
+    The cache is warmed from `license_plates` and `users` and kept coherent by a
+    change stream on both collections. When change streams are unavailable each
+    plate entry (with its owner) expires AUTH_CACHE_TTL seconds after it was
+    read and is read again on its next lookup, so idle gates cost nothing; the
+    users and plates this process writes are forgotten right away. Gate
+    transitions write their results through, so this process never waits for
+    its own updates.
+    """
+
+    def __init__(self, ttl=AUTH_CACHE_TTL, negative_ttl=AUTH_CACHE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._plates = {}
+        self._plate_ids = {}
+        self._expires = {}
+        self._users = {}
+        self._unknown = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.mode = 'starting'
+        self.hits = 0
+        self.misses = 0
+        self.events = 0
+        self.reloads = 0
+        self.last_sync = None
+
+    # --- loading ---
+
+    def _set_plate(self, doc):
+        plate = {'plate': doc['plate'], 'user_id': str(doc.get('user_id')), 'status': bool(doc.get('status', False))}
+        self._plates[plate['plate']] = plate
+        self._plate_ids[doc['_id']] = plate['plate']
+        self._expires[plate['plate']] = time.time() + self.ttl
+        self._unknown.pop(plate['plate'], None)
+
+    def _set_user(self, doc):
+        self._users[str(doc['_id'])] = {
+            'username': doc.get('username'),
+            'line': doc.get('line'),
+            'limit': doc.get('limit', 0),
+        }
+
+    def reload(self):
+        """Replace the cache contents with a fresh copy of both collections."""
+        db = get_mongo_client().db
+        plates = list(db.license_plates.find({}, PLATE_FIELDS))
+        users = list(db.users.find({}, USER_FIELDS))
+        with self._lock:
+            self._plates, self._plate_ids, self._expires, self._users, self._unknown = {}, {}, {}, {}, {}
+            for doc in plates:
+                self._set_plate(doc)
+            for doc in users:
+                self._set_user(doc)
+            self.reloads += 1
+            self.last_sync = time.time()
+        logger.info(f"Authorization cache loaded {len(plates)} plates and {len(users)} users.")
+
+    def apply_change(self, change):
+        """Apply one change stream event."""
+        collection = change['ns']['coll']
+        key = change['documentKey']['_id']
+        doc = change.get('fullDocument')
+        with self._lock:
+            self.events += 1
+            self.last_sync = time.time()
+            if collection == 'license_plates':
+                plate = self._plate_ids.pop(key, None)
+                if plate is not None:
+                    self._plates.pop(plate, None)
+                    self._expires.pop(plate, None)
+                if doc is not None:
+                    self._set_plate(doc)
+            elif collection == 'users':
+                if doc is None:
+                    self._users.pop(str(key), None)
+                else:
+                    self._set_user(doc)
+
+    def _watch(self):
+        db = get_mongo_client().db
+        pipeline = [{'$match': {'ns.coll': {'$in': ['license_plates', 'users']}}}]
+        while not self._stop.is_set():
+            try:
+                with db.watch(pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
+                    # Load after the stream is open so no change between the two is missed
+                    self.reload()
+                    self.mode = 'change_stream'
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            self.apply_change(change)
+                        else:
+                            self.last_sync = time.time()
+            except OperationFailure as e:
+                # Standalone servers have no change streams
+                logger.warning(f"Change streams unavailable, authorization cache entries fall back to a {self.ttl}s TTL: {e}")
+                self.mode = 'ttl'
+                return
+            except PyMongoError as e:
+                logger.error(f"Authorization cache change stream failed, reconnecting: {e}")
+                self.mode = 'reconnecting'
+                self._stop.wait(1)
+            except Exception as e:
+                logger.error(f"Authorization cache change stream unusable, entries fall back to a {self.ttl}s TTL: {e}")
+                self.mode = 'ttl'
+                return
+
+    def forget(self, plate_number):
+        """Drop a plate, known or unknown, so its next lookup reads the database."""
+        with self._lock:
+            # The change stream delivers the write itself
+            if self.mode == 'change_stream':
+                return
+            self._unknown.pop(plate_number, None)
+            if self._plates.pop(plate_number, None) is not None:
+                self._expires.pop(plate_number, None)
+                self._plate_ids = {key: plate for key, plate in self._plate_ids.items() if plate != plate_number}
+
+    def forget_user(self, user_id):
+        """Drop a user and their plates, so their next lookup reads the database."""
+        user_id = str(user_id)
+        with self._lock:
+            if self.mode == 'change_stream':
+                return
+            self._users.pop(user_id, None)
+            plates = {plate for plate, entry in self._plates.items() if entry['user_id'] == user_id}
+            for plate in plates:
+                self._plates.pop(plate, None)
+                self._expires.pop(plate, None)
+            if plates:
+                self._plate_ids = {key: plate for key, plate in self._plate_ids.items() if plate not in plates}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch, name='auth-cache', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # --- lookups ---
+
+    def lookup(self, plate_number):
+        """
+        Return `(plate, user)` entries for a plate number, or `(None, None)` if it is unknown.
+
+        Plates missing from the cache are read once from the database and then
+        remembered as unknown for AUTH_CACHE_NEGATIVE_TTL seconds. Without a
+        change stream, expired entries are read again as well.
+        """
+        with self._lock:
+            live = self.mode == 'change_stream'
+            plate = self._plates.get(plate_number)
+            if plate is not None and (live or self._expires.get(plate_number, 0) > time.time()):
+                self.hits += 1
+                return dict(plate), dict(self._users.get(plate['user_id']) or {}) or None
+            if plate is None and (live or self._unknown.get(plate_number, 0) > time.time()):
+                self.hits += 1
+                return None, None
+            self.misses += 1
+        db = get_mongo_client().db
+        doc = db.license_plates.find_one({'plate': plate_number}, PLATE_FIELDS)
+        if doc is None:
+            with self._lock:
+                stale = self._plates.pop(plate_number, None)
+                if stale is not None:
+                    self._plate_ids = {key: plate for key, plate in self._plate_ids.items() if plate != plate_number}
+                    self._expires.pop(plate_number, None)
+                self._unknown[plate_number] = time.time() + self.negative_ttl
+            return None, None
+        user_id = doc.get('user_id')
+        user_doc = db.users.find_one({'_id': ObjectId(user_id) if ObjectId.is_valid(str(user_id)) else user_id}, USER_FIELDS)
+        with self._lock:
+            self._set_plate(doc)
+            if user_doc is not None:
+                self._set_user(user_doc)
+            else:
+                self._users.pop(str(user_id), None)
+            self.last_sync = time.time()
+            plate = self._plates[plate_number]
+            user = self._users.get(plate['user_id'])
+            return dict(plate), dict(user) if user else None
+
+    def precheck(self, plate_number, status):
+        """
+        Decide from the cache whether a gate transition can succeed.
+
+        Returns:
+            str: 'ok', 'not_found', 'unchanged', 'no_user' or 'no_limit', matching
+            the results of `mongo_gate_transition`.
+        """
+        plate, user = self.lookup(plate_number)
+        if plate is None:
+            return 'not_found'
+        if plate['status'] == status:
+            return 'unchanged'
+        if user is None:
+            return 'no_user'
+        if status and user['limit'] <= 0:
+            return 'no_limit'
+        return 'ok'
+
+    def apply_transition(self, lp, user):
+        """Write the LicensePlate and User returned by a gate transition through to the cache."""
+        with self._lock:
+            if lp is not None:
+                self._set_plate({'_id': ObjectId(lp.id), 'plate': lp.plate, 'user_id': lp.user_id, 'status': lp.status})
+            if user is not None:
+                self._set_user({'_id': user.id, 'username': user.username, 'line': user.line, 'limit': user.limit})
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'mode': self.mode,
+                'plates': len(self._plates),
+                'users': len(self._users),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'events': self.events,
+                'reloads': self.reloads,
+                'staleness_s': round(time.time() - self.last_sync, 3) if self.last_sync else None,
+            }
+
+@per_process
+def get_auth_cache():
+    """Return the process-wide authorization cache, starting it on first use."""
+    cache = PlateAuthCache()
+    cache.start()
+    return cache
+
+def _forget_written(user_ids, plates):
+    cache = get_auth_cache.peek()
+    if cache is None:
+        return
+    for user_id in user_ids:
+        cache.forget_user(user_id)
+    for plate in plates:
+        cache.forget(plate)
+
+on_write(_forget_written)
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark for the `preprocess_image` modes.
+
+Usage (from line_app/):
+    python -m utils.bench_preprocess [-n 20] [frame.jpg ...]
+
+Without frames, synthetic UXGA (1600x1200) JPEGs like the TSIMCAM uploads are
+generated. An 800x600 frame is included to show the pass-through path.
+"""
+import io
+import time
+import argparse
+import random
+from PIL import Image, ImageDraw
+from utils.ai import preprocess_image
+
+def synthetic_frame(size=(1600, 1200), quality=85, seed=0):
+    """Build a noisy JPEG frame with a plate-like box in the middle."""
+    rng = random.Random(seed)
+    img = Image.effect_noise(size, 64).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle([x, y, x + rng.randrange(20, 300), y + rng.randrange(20, 200)],
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    w, h = size
+    draw.rectangle([w // 2 - 160, h // 2 - 60, w // 2 + 160, h // 2 + 60], fill="white", outline="black", width=6)
+    draw.text((w // 2 - 120, h // 2 - 10), "1AB 2345", fill="black")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+def bench(data, mode, iterations):
+    """Return (mean milliseconds, output bytes) for one frame and mode."""
+    preprocess_image(data, mode=mode)  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        out = preprocess_image(data, mode=mode)
+    elapsed = (time.perf_counter() - start) / iterations
+    return elapsed * 1000, len(out.getvalue())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare preprocess_image modes on sample frames.")
+    parser.add_argument("frames", nargs="*", help="JPEG frames to benchmark (default: synthetic frames).")
+    parser.add_argument("-n", "--iterations", type=int, default=20, help="Runs per frame and mode.")
+    args = parser.parse_args(argv)
+
+    if args.frames:
+        frames = []
+        for path in args.frames:
+            with open(path, 'rb') as f:
+                frames.append((path, f.read()))
+    else:
+        frames = [
+            ("synthetic 1600x1200", synthetic_frame()),
+            ("synthetic 800x600", synthetic_frame((800, 600), seed=1)),
+        ]
+
+    print(f"{'frame':<28}{'mode':<10}{'ms/frame':>10}{'out bytes':>12}")
+    for name, data in frames:
+        for mode in ("quality", "fast"):
+            ms, size = bench(data, mode, args.iterations)
+            print(f"{name:<28}{mode:<10}{ms:>10.2f}{size:>12}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+def json_size(key, value):
+    """Approximate memory cost of an entry by its JSON size."""
+    return len(str(key)) + len(json.dumps(value, default=str))
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Args:
+        maxsize (int): Maximum number of entries.
+        ttl (float): Seconds an entry stays valid.
+        max_bytes (int): Memory budget as measured by `sizeof`, 0 for none.
+        sizeof (callable): `sizeof(key, value)` returning the cost of an entry.
+        path (str): Optional JSON file the cache is loaded from and saved to, so
+            entries survive a restart. Values must then be JSON-serializable.
+        save_interval (float): Minimum seconds between two saves to `path`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, max_bytes=0, sizeof=json_size, path=None, save_interval=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._last_save = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def _pop(self, key):
+        expires_at, size, value = self._entries.pop(key)
+        self._bytes -= size
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= time.time():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(key, value) if self.max_bytes else 0
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.time() + (ttl or self.ttl), size, value)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.maxsize or (self.max_bytes and self._bytes > self.max_bytes)):
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+        if self.path and time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+                return True
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def save(self):
+        """Write unexpired entries to `path`, replacing the file atomically."""
+        if not self.path:
+            return
+        with self._lock:
+            now = time.time()
+            entries = [[key, expires_at, value] for key, (expires_at, size, value) in self._entries.items() if expires_at > now]
+            self._last_save = now
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving cache to '{self.path}': {e}")
+
+    def load(self):
+        """Load unexpired entries from `path`, if it exists."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            now = time.time()
+            for key, expires_at, value in entries:
+                if expires_at > now:
+                    self.set(key, value, ttl=expires_at - now)
+            logger.info(f"Loaded {len(self._entries)} cache entries from '{self.path}'.")
+        except Exception as e:
+            logger.error(f"Error loading cache from '{self.path}': {e}")
@@ -0,0 +1,144 @@
+import os
+import io
+import csv
+import json
+import zlib
+import logging
+from datetime import datetime
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING
+from utils.mongodb import get_mongo_client, to_local
+
+load_dotenv()
+
+# Documents fetched per round trip while exporting
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+# Bytes of rows gathered before they are handed to the response
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 64 * 1024))
+
+logger = logging.getLogger()
+
+# Exportable collections: columns, the field the time range applies to and the sort order.
+# Collections without a timestamp filter on the creation time held in their ObjectId.
+EXPORTS = {
+    'parking_history': {
+        'fields': ['plate', 'gate', 'inbound', 'outbound', 'duration_s', 'tz'],
+        'time_field': 'inbound',
+        'sort': [('inbound', ASCENDING), ('_id', ASCENDING)],
+    },
+    'license_plates': {
+        'fields': ['_id', 'plate', 'user_id', 'status'],
+        'time_field': '_id',
+        'sort': [('_id', ASCENDING)],
+    },
+    'users': {
+        'fields': ['_id', 'username', 'is_admin', 'limit', 'line'],
+        'time_field': '_id',
+        'sort': [('_id', ASCENDING)],
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+def _time_bound(field, value):
+    return ObjectId.from_datetime(value) if field == '_id' else value
+
+def export_cursor(name, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Open a server-side cursor over an exportable collection.
+
+    Args:
+        name (str): Key of EXPORTS.
+        since (datetime): Only documents at or after this time (UTC).
+        until (datetime): Only documents before this time (UTC).
+        batch_size (int): Documents per round trip.
+
+    Returns:
+        Cursor: Documents projected to the export columns, in export order.
+    """
+    spec = EXPORTS[name]
+    query = {}
+    if since or until:
+        query[spec['time_field']] = {}
+        if since:
+            query[spec['time_field']]['$gte'] = _time_bound(spec['time_field'], since)
+        if until:
+            query[spec['time_field']]['$lt'] = _time_bound(spec['time_field'], until)
+    projection = {field: 1 for field in spec['fields']}
+    projection.setdefault('_id', 0)
+    db = get_mongo_client().db
+    return db[name].find(query, projection).sort(spec['sort']).batch_size(batch_size)
+
+def _value(doc, field):
+    value = doc.get(field)
+    if isinstance(value, datetime):
+        return to_local(value, doc.get('tz')).isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+def csv_lines(docs, fields):
+    """Yield the CSV header and one CSV line per document."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for doc in docs:
+        writer.writerow(['' if value is None else value for value in (_value(doc, field) for field in fields)])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_lines(docs, fields):
+    """Yield one JSON object per line per document."""
+    for doc in docs:
+        yield json.dumps({field: _value(doc, field) for field in fields}, ensure_ascii=False) + '\n'
+
+def chunked(lines, size=EXPORT_CHUNK_SIZE):
+    """Group text lines into UTF-8 chunks of about `size` bytes."""
+    parts = []
+    length = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield b''.join(parts)
+
+def gzipped(chunks, level=6):
+    """Compress a stream of byte chunks into a gzip stream as it is produced."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(name, fmt='csv', since=None, until=None, batch_size=EXPORT_BATCH_SIZE, gzip=False):
+    """
+    Stream a collection export as bytes, reading the cursor batch by batch.
+
+    Returns:
+        generator: Byte chunks of the CSV or NDJSON export, gzip-compressed if asked.
+    """
+    fields = EXPORTS[name]['fields']
+    cursor = export_cursor(name, since, until, batch_size)
+    lines = csv_lines(cursor, fields) if fmt == 'csv' else ndjson_lines(cursor, fields)
+    chunks = chunked(lines)
+    if gzip:
+        chunks = gzipped(chunks)
+    try:
+        yield from chunks
+        logger.info(f"Exported {name} as {fmt}{' (gzip)' if gzip else ''}.")
+    except Exception as e:
+        logger.error(f"Error exporting {name}: {e}")
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,88 @@
+import os
+import time
+import queue
+import threading
+import logging
+from dotenv import load_dotenv
+from utils.per_process import per_process
+
+load_dotenv()
+
+# Set FRAME_ARCHIVE=0 to stop keeping uploaded frames on disk
+FRAME_ARCHIVE = os.getenv('FRAME_ARCHIVE', '1') not in ('0', 'false', 'False', '')
+# Frames waiting for the disk; further frames are not archived while it is full
+FRAME_ARCHIVE_QUEUE = int(os.getenv('FRAME_ARCHIVE_QUEUE', 64))
+
+logger = logging.getLogger()
+
+class FrameArchiver:
+    """Writes frames to disk on a background thread from a bounded queue, dropping frames when the disk falls behind."""
+
+    def __init__(self, maxsize=FRAME_ARCHIVE_QUEUE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name='frame-archive', daemon=True).start()
+
+    def submit(self, image_file, data):
+        """Queue a frame for writing. Returns False if the queue is full and the frame was dropped."""
+        try:
+            self._queue.put_nowait((image_file, data))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Frame archive queue full, not archiving '{image_file}'.")
+            return False
+
+    def _run(self):
+        while True:
+            image_file, data = self._queue.get()
+            try:
+                os.makedirs(os.path.dirname(image_file), exist_ok=True)
+                with open(image_file, 'wb') as f:
+                    f.write(data)
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error archiving frame '{image_file}': {e}")
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+@per_process
+def get_frame_archiver():
+    """Return the process-wide frame archiver, starting its writer on first use."""
+    archiver = FrameArchiver()
+    archiver.start()
+    return archiver
+
+def archive_frame(image_dir, session, data, timestamp=None):
+    """
+    Persist a frame to `<image_dir>/<session>/<time>.jpg` in the background.
+
+    Args:
+        image_dir (str): Gate archive directory.
+        session (str): Folder name of the current gate session.
+        data (bytes): Uploaded JPEG bytes.
+        timestamp (float): Arrival time of the frame, defaults to now.
+
+    Returns:
+        str: Path the frame will be written to, or None when archiving is disabled
+        or the archive queue is full.
+    """
+    if not FRAME_ARCHIVE:
+        return None
+    local_time = time.localtime(timestamp or time.time())
+    readable_time = time.strftime("%d-%m-%y-%H:%M:%S", local_time)
+    image_file = os.path.join(image_dir, session, f"{readable_time}.jpg")
+    if not get_frame_archiver().submit(image_file, data):
+        return None
+    return image_file
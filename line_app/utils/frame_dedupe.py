@@ -0,0 +1,79 @@
+import os
+import io
+import threading
+import logging
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Frames whose difference hash is within this many bits of the last analyzed
+# frame of the same gate session are not sent to LPR; set to -1 to disable
+DEDUPE_DISTANCE = int(os.getenv('DEDUPE_DISTANCE', 4))
+DEDUPE_HASH_SIZE = 8
+
+logger = logging.getLogger()
+
+def dhash(data, hash_size=DEDUPE_HASH_SIZE):
+    """
+    Compute the difference hash of an image.
+
+    Args:
+        data (bytes): Encoded image bytes.
+        hash_size (int): Hash grid size; the hash has hash_size * hash_size bits.
+
+    Returns:
+        int: The hash as an integer bit field.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        # Decode JPEGs at 1/8 scale, the hash only needs a thumbnail
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+class FrameDeduplicator:
+    """Remembers the last analyzed frame hash per gate session and flags near-duplicates."""
+
+    def __init__(self, max_distance=DEDUPE_DISTANCE):
+        self.max_distance = max_distance
+        self._last = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _count(self, gate, key):
+        counters = self._counters.setdefault(gate, {'checked': 0, 'skipped': 0})
+        counters[key] += 1
+
+    def is_duplicate(self, gate, session, digest):
+        """Return True if `digest` is close to the last analyzed frame of this gate session."""
+        with self._lock:
+            self._count(gate, 'checked')
+            last = self._last.get(gate)
+            if last is None or last[0] != session or self.max_distance < 0:
+                return False
+            if hamming_distance(last[1], digest) <= self.max_distance:
+                self._count(gate, 'skipped')
+                return True
+            return False
+
+    def remember(self, gate, session, digest):
+        """Record `digest` as the last frame analyzed for this gate session."""
+        with self._lock:
+            self._last[gate] = (session, digest)
+
+    def stats(self, gate):
+        with self._lock:
+            counters = dict(self._counters.get(gate, {'checked': 0, 'skipped': 0}))
+        counters['max_distance'] = self.max_distance
+        return counters
+
+frame_dedupe = FrameDeduplicator()
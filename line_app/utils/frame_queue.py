@@ -0,0 +1,184 @@
+import os
+import time
+import uuid
+import threading
+import logging
+from collections import deque, OrderedDict
+from dotenv import load_dotenv
+from utils.per_process import per_process
+
+load_dotenv()
+
+# Frames kept waiting per gate; older frames are dropped when a newer one arrives
+FRAME_QUEUE_DEPTH = int(os.getenv('FRAME_QUEUE_DEPTH', 1))
+# Number of frame outcomes kept for polling
+FRAME_RESULTS_MAX = int(os.getenv('FRAME_RESULTS_MAX', 1000))
+
+logger = logging.getLogger()
+
+class FrameResults:
+    """Bounded store of frame outcomes keyed by frame id, oldest evicted first."""
+
+    def __init__(self, maxlen=FRAME_RESULTS_MAX):
+        self.maxlen = maxlen
+        self._results = OrderedDict()
+        self._cond = threading.Condition()
+
+    def set(self, frame, state, status=None, body=None):
+        """Record the state of a frame: queued, processing, dropped, discarded or done."""
+        with self._cond:
+            self._results[frame['id']] = {
+                'frame_id': frame['id'],
+                'gate': frame['gate'],
+                'state': state,
+                'status': status,
+                'result': body,
+                'received_at': frame['received_at'],
+                'updated_at': time.time(),
+            }
+            self._results.move_to_end(frame['id'])
+            while len(self._results) > self.maxlen:
+                self._results.popitem(last=False)
+            self._cond.notify_all()
+
+    def get(self, frame_id):
+        with self._cond:
+            result = self._results.get(frame_id)
+            return dict(result) if result else None
+
+    def wait(self, frame_id, timeout):
+        """Block until the frame is done, dropped or discarded, or `timeout` seconds pass."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                result = self._results.get(frame_id)
+                if result is None or result['state'] in ('done', 'dropped', 'discarded'):
+                    return dict(result) if result else None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return dict(result)
+                self._cond.wait(remaining)
+
+frame_results = FrameResults()
+
+class GateFrameQueue:
+    """Bounded frame queue for one gate with latest-frame-wins semantics.
+
+    A single worker thread hands frames to `handler` one at a time. While the
+    handler is busy, newly received frames supersede the oldest waiting ones so
+    the gate always acts on the newest image. The handler returns a
+    `(body, status)` tuple which is recorded in `frame_results`. Every final
+    outcome (done, dropped or discarded) is also passed to
+    `on_result(frame, state, status, body)` when given.
+    """
+
+    def __init__(self, gate, handler, maxlen=FRAME_QUEUE_DEPTH, on_result=None):
+        self.gate = gate
+        self.handler = handler
+        self.on_result = on_result
+        self.maxlen = max(1, maxlen)
+        self._frames = deque()
+        self._cond = threading.Condition()
+        self._busy = False
+        self.received = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.processed = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name=f"frames-{gate}", daemon=True)
+        self._thread.start()
+        logger.info(f"Frame queue for gate '{gate}' started (depth {self.maxlen}).")
+
+    def _finished(self, frame, state, status=None, body=None):
+        frame_results.set(frame, state, status, body)
+        if self.on_result is not None:
+            try:
+                self.on_result(frame, state, status, body)
+            except Exception as e:
+                logger.error(f"Error reporting frame outcome for gate '{self.gate}': {e}")
+
+    def put(self, frame):
+        """Queue a frame, dropping superseded ones. Returns the queue depth."""
+        dropped = []
+        with self._cond:
+            self.received += 1
+            while len(self._frames) >= self.maxlen:
+                dropped.append(self._frames.popleft())
+                self.dropped += 1
+            frame_results.set(frame, 'queued')
+            self._frames.append(frame)
+            self._cond.notify()
+            depth = len(self._frames)
+        for old in dropped:
+            self._finished(old, 'dropped')
+        return depth
+
+    def discard(self, predicate):
+        """Remove waiting frames for which `predicate(frame)` is true. Returns how many were removed."""
+        with self._cond:
+            kept = deque()
+            removed = []
+            for frame in self._frames:
+                if predicate(frame):
+                    removed.append(frame)
+                else:
+                    kept.append(frame)
+            self._frames = kept
+            self.discarded += len(removed)
+        for frame in removed:
+            self._finished(frame, 'discarded')
+        return len(removed)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._frames:
+                    self._cond.wait()
+                frame = self._frames.popleft()
+                self._busy = True
+            frame_results.set(frame, 'processing')
+            try:
+                body, status = self.handler(frame)
+                self.processed += 1
+                self._finished(frame, 'done', status, body)
+            except Exception as e:
+                self.failed += 1
+                self._finished(frame, 'done', 500, {"error": f"Error processing frame: {e}"})
+                logger.error(f"Error processing frame for gate '{self.gate}': {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+
+    def stats(self):
+        """Return queue depth and frame counters."""
+        with self._cond:
+            return {
+                'gate': self.gate,
+                'depth': len(self._frames),
+                'max_depth': self.maxlen,
+                'busy': self._busy,
+                'received': self.received,
+                'dropped': self.dropped,
+                'discarded': self.discarded,
+                'processed': self.processed,
+                'failed': self.failed,
+            }
+
+# Frame queues of this process by gate
+_queues = per_process(dict)
+_queues_lock = threading.Lock()
+
+def get_frame_queue(gate, handler, on_result=None):
+    """Return the queue for `gate`, starting its worker on first use in this process."""
+    queues = _queues()
+    with _queues_lock:
+        queue = queues.get(gate)
+        if queue is None:
+            queue = queues[gate] = GateFrameQueue(gate, handler, on_result=on_result)
+        return queue
+
+def new_frame(gate, **fields):
+    """Build a frame record stamped with a frame id, its gate and arrival time."""
+    frame = {'id': uuid.uuid4().hex, 'gate': gate, 'received_at': time.time()}
+    frame.update(fields)
+    return frame
@@ -0,0 +1,183 @@
+import os
+import socket
+import atexit
+import threading
+import logging
+import paho.mqtt.client as mqtt
+from dotenv import load_dotenv
+from utils.per_process import per_process
+
+load_dotenv()
+
+MQTT_BROKER = os.getenv('MQTT_BROKER')
+MQTT_PORT = int(os.getenv('MQTT_PORT') or 1883)
+MQTT_KEEPALIVE = int(os.getenv('MQTT_KEEPALIVE', 60))
+# QoS of the gate control subscriptions and of the barrier and result publishes
+MQTT_QOS = int(os.getenv('MQTT_QOS', 1))
+# Reconnection backoff: the delay doubles from the minimum up to the maximum
+MQTT_RECONNECT_MIN_S = int(os.getenv('MQTT_RECONNECT_MIN_S', 1))
+MQTT_RECONNECT_MAX_S = int(os.getenv('MQTT_RECONNECT_MAX_S', 60))
+# Prefix of the client id; the host name and pid are appended so workers do not take over each other's session
+MQTT_CLIENT_ID = os.getenv('MQTT_CLIENT_ID', 'line_app')
+
+logger = logging.getLogger()
+
+# In-process dispatch table shared by every controller of this process: topic -> (handler, qos)
+_routes = {}
+_routes_lock = threading.Lock()
+
+def gate_topic(gate, suffix=None):
+    """Topic of a gate ('inbound/gate1' -> '/inbound/gate1'), or of one of its subtopics."""
+    return f"/{gate}/{suffix}" if suffix else f"/{gate}"
+
+class GateController:
+    """
+    The process's single MQTT connection to the gates.
+
+    Handlers are registered per topic with `route`; each incoming message is
+    looked up in that dispatch table and handed to its handler only, so a gate reacts
+    to its own control topic and nothing else. Routed topics are subscribed
+    again on every (re)connection. The paho network thread reconnects with
+    exponential backoff between MQTT_RECONNECT_MIN_S and MQTT_RECONNECT_MAX_S;
+    QoS 1 publishes made while disconnected are queued and sent on reconnect.
+    """
+
+    def __init__(self, broker=MQTT_BROKER, port=MQTT_PORT, keepalive=MQTT_KEEPALIVE, qos=MQTT_QOS):
+        self.broker = broker
+        self.port = port
+        self.keepalive = keepalive
+        self.qos = qos
+        self._client = None
+        self._pid = None
+        self.connected = False
+        self.connects = 0
+        self.disconnects = 0
+        self.received = 0
+        self.unrouted = 0
+        self.handler_errors = 0
+        self.published = 0
+        self.publish_errors = 0
+
+    def start(self):
+        self._pid = os.getpid()
+        client_id = f"{MQTT_CLIENT_ID}-{socket.gethostname()}-{self._pid}"
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_connect_fail = self._on_connect_fail
+        self._client.on_message = self._on_message
+        self._client.reconnect_delay_set(MQTT_RECONNECT_MIN_S, MQTT_RECONNECT_MAX_S)
+        # Connect from the network thread so an unreachable broker does not block startup
+        self._client.connect_async(self.broker, self.port, self.keepalive)
+        self._client.loop_start()
+        logger.info(f"Gate controller connecting to MQTT broker {self.broker}:{self.port} as '{client_id}'.")
+
+    def stop(self):
+        """Disconnect cleanly and stop the network thread."""
+        # A forked child inherits the parent's socket: leave that connection to the parent
+        if self._client is None or self._pid != os.getpid():
+            return
+        self._client.disconnect()
+        self._client.loop_stop()
+        self._client = None
+        self.connected = False
+        logger.info("Gate controller stopped.")
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error(f"MQTT connection refused: {reason_code}")
+            return
+        self.connected = True
+        self.connects += 1
+        with _routes_lock:
+            subscriptions = [(topic, self.qos if qos is None else qos) for topic, (handler, qos) in _routes.items()]
+        if subscriptions:
+            client.subscribe(subscriptions)
+        logger.info(f"Gate controller connected, subscribed to {[topic for topic, _ in subscriptions]}.")
+
+    def _on_connect_fail(self, client, userdata):
+        logger.warning(f"Could not reach MQTT broker {self.broker}:{self.port}, retrying.")
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        self.connected = False
+        self.disconnects += 1
+        if reason_code != 0:
+            logger.warning(f"MQTT connection lost ({reason_code}), reconnecting.")
+
+    def _handler(self, topic):
+        with _routes_lock:
+            route = _routes.get(topic)
+            if route is None:
+                route = next((route for pattern, route in _routes.items() if mqtt.topic_matches_sub(pattern, topic)), None)
+        return route[0] if route else None
+
+    def _on_message(self, client, userdata, msg):
+        self.received += 1
+        handler = self._handler(msg.topic)
+        if handler is None:
+            self.unrouted += 1
+            return
+        try:
+            handler(msg.topic, msg.payload.decode('utf-8'))
+        except Exception as e:
+            self.handler_errors += 1
+            logger.error(f"Error handling MQTT message on '{msg.topic}': {e}")
+
+    def publish(self, topic, payload, qos=None, retain=False):
+        """Publish without waiting for the broker. Returns False if the message could not be queued."""
+        client = self._client
+        if client is None:
+            self.publish_errors += 1
+            return False
+        qos = self.qos if qos is None else qos
+        info = client.publish(topic, payload, qos=qos, retain=retain)
+        # With QoS 1 and 2 paho keeps the message and sends it once the connection is back
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and not (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+            self.publish_errors += 1
+            logger.warning(f"MQTT publish to '{topic}' failed: {mqtt.error_string(info.rc)}")
+            return False
+        self.published += 1
+        return True
+
+    def subscribe(self, topic, qos=None):
+        client = self._client
+        if client is not None and self.connected:
+            client.subscribe(topic, self.qos if qos is None else qos)
+
+    def stats(self):
+        with _routes_lock:
+            routes = list(_routes)
+        return {
+            'connected': self.connected,
+            'routes': routes,
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'received': self.received,
+            'unrouted': self.unrouted,
+            'handler_errors': self.handler_errors,
+            'published': self.published,
+            'publish_errors': self.publish_errors,
+        }
+
+def route(topic, handler, qos=None):
+    """
+    Call `handler(topic, payload)` on the MQTT thread for messages on `topic`.
+
+    Routes are registered at import time and do not connect by themselves;
+    a running controller subscribes to a new route right away, and every
+    controller subscribes to all routes when it (re)connects. `qos` defaults
+    to MQTT_QOS. MQTT wildcards are allowed; exact topics are matched first.
+    """
+    with _routes_lock:
+        _routes[topic] = (handler, qos)
+    controller = get_gate_controller.peek()
+    if controller is not None:
+        controller.subscribe(topic, qos)
+
+@per_process
+def get_gate_controller():
+    """Return the process-wide gate controller, connecting it on first use."""
+    controller = GateController()
+    controller.start()
+    atexit.register(controller.stop)
+    return controller
@@ -0,0 +1,137 @@
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import Future, wait, FIRST_COMPLETED, CancelledError
+
+logger = logging.getLogger()
+
+class GateSession:
+    """One car's pass through a gate: open until a plate is decided or the gate is re-enabled."""
+
+    def __init__(self, gate):
+        self.gate = gate
+        self.id = str(uuid.uuid4())
+        self.state = 'open'
+        self.started_at = time.time()
+        self.closed_at = None
+        self.closed = Future()  # Resolved when the session leaves the open state
+        self.inflight = set()
+
+class SessionClosed(Exception):
+    """Raised when a frame's gate session was decided or replaced while it was being processed."""
+
+class GateSessions:
+    """Per-gate session state machine keyed by the folder uuid that the MQTT `enable` message rotates.
+
+    States: open -> decided (a plate was checked in/out) or open -> expired
+    (replaced by a newer session). Frames from a session that is no longer
+    open are discarded before recognition, and in-flight recognitions are
+    cancelled when the session closes.
+    """
+
+    def __init__(self):
+        self._current = {}
+        self._sessions = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _count(self, gate, key, n=1):
+        counters = self._counters.setdefault(gate, {'decided': 0, 'expired': 0, 'cancelled': 0})
+        counters[key] += n
+
+    def _get_current(self, gate):
+        session = self._current.get(gate)
+        if session is None:
+            session = self._current[gate] = GateSession(gate)
+            self._sessions[session.id] = session
+        return session
+
+    def _close(self, session, state):
+        session.state = state
+        session.closed_at = time.time()
+        self._count(session.gate, state)
+        self._count(session.gate, 'cancelled', sum(future.cancel() for future in session.inflight))
+        session.inflight.clear()
+        session.closed.set_result(state)
+        self._sessions.pop(session.id, None)
+
+    def current(self, gate):
+        """Return the id of the gate's current session."""
+        with self._lock:
+            return self._get_current(gate).id
+
+    def rotate(self, gate):
+        """Start a new session for the gate, expiring the previous one if still open."""
+        with self._lock:
+            previous = self._current.get(gate)
+            if previous is not None and previous.state == 'open':
+                self._close(previous, 'expired')
+            session = self._current[gate] = GateSession(gate)
+            self._sessions[session.id] = session
+            logger.info(f"Gate '{gate}' started session {session.id}.")
+            return session.id
+
+    def decide(self, gate, session_id):
+        """Mark a session as decided. Returns False if it was no longer open."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.state != 'open':
+                return False
+            self._close(session, 'decided')
+            logger.info(f"Gate '{gate}' session {session_id} decided.")
+            return True
+
+    def is_open(self, gate, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session is not None and session.state == 'open'
+
+    def run(self, gate, session_id, future, timeout=None):
+        """
+        Wait for an in-flight recognition, giving up as soon as its session closes.
+
+        Args:
+            gate (str): Gate the frame belongs to.
+            session_id (str): Session the frame was received in.
+            future (Future): Pending recognition.
+            timeout (float): Maximum seconds to wait.
+
+        Returns:
+            The future's result.
+
+        Raises:
+            SessionClosed: If the session is closed before or while waiting.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.state != 'open':
+                if future.cancel():
+                    self._count(gate, 'cancelled')
+                raise SessionClosed(f"Session {session_id} of gate '{gate}' is closed.")
+            session.inflight.add(future)
+        try:
+            done, _ = wait([future, session.closed], timeout=timeout, return_when=FIRST_COMPLETED)
+            if future not in done:
+                if session.closed in done:
+                    raise SessionClosed(f"Session {session_id} of gate '{gate}' closed during recognition.")
+                raise TimeoutError(f"Recognition for gate '{gate}' timed out.")
+            return future.result()
+        except CancelledError:
+            raise SessionClosed(f"Recognition for session {session_id} of gate '{gate}' was cancelled.")
+        finally:
+            with self._lock:
+                session.inflight.discard(future)
+
+    def stats(self, gate):
+        with self._lock:
+            session = self._get_current(gate)
+            stats = {
+                'session': session.id,
+                'state': session.state,
+                'inflight': len(session.inflight),
+            }
+            stats.update(self._counters.get(gate, {'decided': 0, 'expired': 0, 'cancelled': 0}))
+            return stats
+
+gate_sessions = GateSessions()
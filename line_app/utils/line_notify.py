@@ -0,0 +1,224 @@
+import os
+import time
+import uuid
+import heapq
+import random
+import threading
+import logging
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+from linebot.v3.messaging import (
+    PushMessageRequest,
+    MulticastRequest,
+    TextMessage,
+    ApiException
+)
+
+load_dotenv()
+
+# Background threads delivering notifications
+LINE_NOTIFY_WORKERS = int(os.getenv('LINE_NOTIFY_WORKERS', 2))
+# Notifications waiting for delivery; new ones are dropped beyond this
+LINE_NOTIFY_QUEUE_MAX = int(os.getenv('LINE_NOTIFY_QUEUE_MAX', 10000))
+# Seconds a notification waits for others with the same text before it is sent
+LINE_NOTIFY_COALESCE_S = float(os.getenv('LINE_NOTIFY_COALESCE_S', 0.2))
+# Retries on 429/5xx and network errors, backing off exponentially from LINE_NOTIFY_BACKOFF_S
+LINE_NOTIFY_MAX_RETRIES = int(os.getenv('LINE_NOTIFY_MAX_RETRIES', 5))
+LINE_NOTIFY_BACKOFF_S = float(os.getenv('LINE_NOTIFY_BACKOFF_S', 1.0))
+LINE_NOTIFY_BACKOFF_MAX_S = float(os.getenv('LINE_NOTIFY_BACKOFF_MAX_S', 60.0))
+
+# LINE accepts at most this many recipients per multicast
+MULTICAST_MAX_RECIPIENTS = 500
+# Delivery latencies kept for the stats
+LATENCY_SAMPLES = 1000
+
+logger = logging.getLogger()
+
+class Notification:
+    __slots__ = ('to', 'text', 'enqueued_at')
+
+    def __init__(self, to, text):
+        self.to = to
+        self.text = text
+        self.enqueued_at = time.time()
+
+class Delivery:
+    """One push or multicast call: a text, its recipients and the retry state."""
+
+    def __init__(self, text, notifications):
+        self.text = text
+        self.notifications = notifications
+        self.attempts = 0
+        # The same retry key on every attempt lets LINE drop duplicates of a request that did get through
+        self.retry_key = str(uuid.uuid4())
+
+    @property
+    def recipients(self):
+        return list(dict.fromkeys(notification.to for notification in self.notifications))
+
+class LineNotifier:
+    """
+    Asynchronous LINE push notifications.
+
+    `get_api` returns the Messaging API client to send with. `notify` only
+    queues the message. Worker threads wait LINE_NOTIFY_COALESCE_S
+    for other notifications with the same text, send them as one push (single
+    recipient) or multicast call, and retry 429 and 5xx responses with
+    exponential backoff. Nothing on the caller's path waits on the LINE API.
+    """
+
+    def __init__(self, get_api, workers=LINE_NOTIFY_WORKERS, coalesce_s=LINE_NOTIFY_COALESCE_S,
+                 max_retries=LINE_NOTIFY_MAX_RETRIES, queue_max=LINE_NOTIFY_QUEUE_MAX):
+        self.get_api = get_api
+        self.workers = workers
+        self.coalesce_s = coalesce_s
+        self.max_retries = max_retries
+        self.queue_max = queue_max
+        self._pending = OrderedDict()  # text -> [Notification], oldest text first
+        self._queued = 0
+        self._retries = []  # heap of (due, seq, Delivery)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._pid = None
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.queued = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.push_calls = 0
+        self.multicast_calls = 0
+
+    def _start(self):
+        # Called with the condition held; threads do not survive a fork, so restart them in a new process
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for index in range(self.workers):
+            threading.Thread(target=self._run, name=f"line-notify-{index}", daemon=True).start()
+        logger.info(f"LINE notifier started with {self.workers} workers.")
+
+    def notify(self, to, text):
+        """Queue a text message for a LINE user. Returns False if the queue is full."""
+        with self._cond:
+            self._start()
+            if self._queued >= self.queue_max:
+                self.dropped += 1
+                logger.warning(f"LINE notification queue full, dropping message to {to}.")
+                return False
+            self._pending.setdefault(text, []).append(Notification(to, text))
+            self._queued += 1
+            self.queued += 1
+            self._cond.notify()
+            return True
+
+    def _next_delivery(self):
+        with self._cond:
+            while True:
+                now = time.time()
+                timeout = None
+                if self._retries:
+                    due = self._retries[0][0]
+                    if due <= now:
+                        return heapq.heappop(self._retries)[2]
+                    timeout = due - now
+                if self._pending:
+                    text, notifications = next(iter(self._pending.items()))
+                    ready_at = notifications[0].enqueued_at + self.coalesce_s
+                    if ready_at <= now:
+                        del self._pending[text]
+                        batch = notifications[:MULTICAST_MAX_RECIPIENTS]
+                        if len(notifications) > MULTICAST_MAX_RECIPIENTS:
+                            self._pending[text] = notifications[MULTICAST_MAX_RECIPIENTS:]
+                            self._pending.move_to_end(text, last=False)
+                        self._queued -= len(batch)
+                        return Delivery(text, batch)
+                    timeout = ready_at - now if timeout is None else min(timeout, ready_at - now)
+                self._cond.wait(timeout)
+
+    def _send(self, api, delivery):
+        recipients = delivery.recipients
+        messages = [TextMessage(text=delivery.text)]
+        if len(recipients) == 1:
+            self._count('push_calls')
+            api.push_message_with_http_info(
+                PushMessageRequest(to=recipients[0], messages=messages),
+                x_line_retry_key=delivery.retry_key
+            )
+        else:
+            self._count('multicast_calls')
+            api.multicast_with_http_info(
+                MulticastRequest(to=recipients, messages=messages),
+                x_line_retry_key=delivery.retry_key
+            )
+
+    def _count(self, counter, amount=1):
+        # Counters are updated by every worker thread
+        with self._cond:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _retry_delay(self, delivery, error):
+        retry_after = (getattr(error, 'headers', None) or {}).get('Retry-After')
+        if retry_after and str(retry_after).isdigit():
+            return float(retry_after)
+        delay = min(LINE_NOTIFY_BACKOFF_S * 2 ** (delivery.attempts - 1), LINE_NOTIFY_BACKOFF_MAX_S)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _retry(self, delivery, error):
+        if delivery.attempts > self.max_retries:
+            self._count('failed', len(delivery.notifications))
+            logger.error(f"Giving up on LINE message to {delivery.recipients} after {delivery.attempts} attempts: {error}")
+            return
+        delay = self._retry_delay(delivery, error)
+        logger.warning(f"LINE message to {delivery.recipients} failed ({error}), retrying in {delay:.1f}s.")
+        with self._cond:
+            self.retried += 1
+            self._seq += 1
+            heapq.heappush(self._retries, (time.time() + delay, self._seq, delivery))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            delivery = self._next_delivery()
+            delivery.attempts += 1
+            try:
+                self._send(self.get_api(), delivery)
+            except ApiException as e:
+                if e.status == 409 and delivery.attempts > 1:
+                    # LINE already accepted this retry key: an earlier attempt got through
+                    pass
+                elif e.status == 429 or (e.status or 0) >= 500:
+                    self._retry(delivery, e)
+                    continue
+                else:
+                    self._count('failed', len(delivery.notifications))
+                    logger.error(f"LINE rejected message to {delivery.recipients}: {e.status} {e.body}")
+                    continue
+            except Exception as e:
+                # Connection errors and timeouts
+                self._retry(delivery, e)
+                continue
+            now = time.time()
+            with self._cond:
+                self.delivered += len(delivery.notifications)
+                self._latencies.extend(now - notification.enqueued_at for notification in delivery.notifications)
+            logger.info(f"LINE message delivered to {delivery.recipients}: {delivery.text}")
+
+    def stats(self):
+        """Return queue size, delivery counters and delivery latency (seconds from notify to sent)."""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            return {
+                'pending': self._queued,
+                'retrying': len(self._retries),
+                'queued': self.queued,
+                'dropped': self.dropped,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'retried': self.retried,
+                'push_calls': self.push_calls,
+                'multicast_calls': self.multicast_calls,
+                'latency_avg_s': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'latency_p95_s': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+                'latency_max_s': round(latencies[-1], 3) if latencies else None,
+            }
@@ -0,0 +1,85 @@
+"""
+Load test for the frame ingestion path.
+
+Start the app with an offline recognizer, e.g.
+    LPR_BACKEND=stub flask --app app run --port 5002
+    LPR_BACKEND=replay LPR_REPLAY_PATH=logs/lpr_replay.jsonl flask --app app run --port 5002
+
+then, from line_app/:
+    python -m utils.loadtest http://localhost:5002/inimage/video -n 200 -c 4 --plate "1AB 2345"
+
+Frames are synthetic UXGA JPEGs (or the given files) carrying an `LPR:<plate>`
+comment for the stub backend. With --wait the request blocks until the frame
+is processed, so the latencies cover the whole recognition and check-in path.
+"""
+import io
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import Image
+from utils.bench_preprocess import synthetic_frame
+from utils.lpr_backends import PLATE_MARKER
+
+def mark_frame(data, plate):
+    """Re-save a JPEG with the stub backend's plate comment."""
+    with Image.open(io.BytesIO(data)) as img:
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85, comment=PLATE_MARKER + plate.encode('utf-8'))
+    return buf.getvalue()
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure throughput and latency of the frame upload endpoint.")
+    parser.add_argument("url", help="Upload URL, e.g. http://localhost:5002/inimage/video")
+    parser.add_argument("frames", nargs="*", help="JPEG frames to upload (default: synthetic frames).")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="Total uploads.")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Concurrent uploaders.")
+    parser.add_argument("--plate", default="", help="Plate embedded in the frames for the stub backend.")
+    parser.add_argument("--wait", type=float, default=0, help="Seconds each upload waits for its outcome.")
+    args = parser.parse_args(argv)
+
+    if args.frames:
+        frames = []
+        for path in args.frames:
+            with open(path, 'rb') as f:
+                frames.append(f.read())
+    else:
+        frames = [synthetic_frame(seed=seed) for seed in range(4)]
+    if args.plate:
+        frames = [mark_frame(data, args.plate) for data in frames]
+
+    latencies = []
+    codes = {}
+    lock = threading.Lock()
+    session = requests.Session()
+    params = {'wait': args.wait} if args.wait else None
+
+    def upload(i):
+        data = frames[i % len(frames)]
+        start = time.perf_counter()
+        try:
+            code = session.post(args.url, files={'file': ('frame.jpg', data, 'image/jpeg')}, params=params).status_code
+        except requests.RequestException as e:
+            code = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            codes[code] = codes.get(code, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(upload, range(args.requests)))
+    total = time.perf_counter() - start
+
+    print(f"requests:   {args.requests} in {total:.2f}s ({args.requests / total:.1f} req/s)")
+    print(f"latency ms: p50 {percentile(latencies, 0.5) * 1000:.1f}  p95 {percentile(latencies, 0.95) * 1000:.1f}  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}  max {max(latencies) * 1000:.1f}")
+    print(f"responses:  {codes}")
+
+if __name__ == '__main__':
+    main()
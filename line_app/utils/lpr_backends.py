@@ -0,0 +1,177 @@
+import os
+import abc
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Recognizer backend: "aift" (remote API), "stub" (offline stand-in),
+# "record" (aift, saving responses) or "replay" (play back saved responses)
+LPR_BACKEND = os.getenv('LPR_BACKEND', 'aift')
+
+# The aift client only accepts a file path, so frames are spooled to tmpfs when available
+LPR_SPOOL_DIR = os.getenv('LPR_SPOOL_DIR', '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir())
+
+# Stub backend: JSON file mapping image SHA-256 to a plate, plate returned for unknown
+# frames (empty for none) and simulated latency in seconds
+LPR_STUB_PLATES = os.getenv('LPR_STUB_PLATES') or None
+LPR_STUB_DEFAULT = os.getenv('LPR_STUB_DEFAULT', '')
+LPR_STUB_LATENCY = float(os.getenv('LPR_STUB_LATENCY', 0))
+
+# Record/replay backend: JSON lines file of recorded responses
+LPR_REPLAY_PATH = os.getenv('LPR_REPLAY_PATH', 'logs/lpr_replay.jsonl')
+
+# JPEG comment prefix the stub backend reads the plate from, e.g. "LPR:1AB 2345"
+PLATE_MARKER = b"LPR:"
+
+logger = logging.getLogger()
+
+def image_digest(image_bytes):
+    """SHA-256 hex digest of in-memory image bytes."""
+    return hashlib.sha256(image_bytes.getbuffer()).hexdigest()
+
+class LPRBackend(abc.ABC):
+    """Interface of a license plate recognizer: preprocessed JPEG bytes in, raw lpr-v2 style results out."""
+
+    name = None
+
+    @abc.abstractmethod
+    def analyze(self, image_bytes):
+        """
+        Args:
+            image_bytes (BytesIO): Preprocessed JPEG bytes.
+
+        Returns:
+            list: Dicts shaped like the aift lpr-v2 response (`lpr`, `conf`, `bbox`).
+        """
+
+class AiftBackend(LPRBackend):
+    """AI for Thai lpr-v2 service via the aift client."""
+
+    name = 'aift'
+
+    def __init__(self):
+        from aift import setting
+        from aift.image.detection import lpr
+        # Set the API key for the AI service
+        setting.set_api_key(os.getenv('AI_API_KEY'))
+        self._lpr = lpr
+        # One reusable spool file per worker thread
+        self._spool = threading.local()
+
+    def _spool_file(self):
+        """Return this thread's reusable spool file, creating it on first use."""
+        spool = getattr(self._spool, 'file', None)
+        if spool is None:
+            spool = self._spool.file = tempfile.NamedTemporaryFile(dir=LPR_SPOOL_DIR, prefix="lpr-", suffix=".jpg", delete=True)
+        return spool
+
+    def analyze(self, image_bytes):
+        # Overwrite this thread's spool file in place instead of creating a new temporary file
+        spool = self._spool_file()
+        spool.seek(0)
+        spool.write(image_bytes.getbuffer())
+        spool.truncate()
+        spool.flush()  # Ensure all data is written
+        # Call the lpr.analyze function with the spool file path
+        return self._lpr.analyze(spool.name, crop=1, rotate=1)
+
+class StubBackend(LPRBackend):
+    """
+    Deterministic offline stand-in for load tests.
+
+    The plate is taken from an `LPR:<plate>` JPEG comment embedded in the
+    frame, else from the LPR_STUB_PLATES sidecar file keyed by the SHA-256 of
+    the preprocessed image, else LPR_STUB_DEFAULT.
+    """
+
+    name = 'stub'
+
+    def __init__(self, plates_path=LPR_STUB_PLATES, default=LPR_STUB_DEFAULT, latency=LPR_STUB_LATENCY):
+        self.plates = {}
+        if plates_path:
+            with open(plates_path) as f:
+                self.plates = json.load(f)
+        self.default = default
+        self.latency = latency
+
+    def analyze(self, image_bytes):
+        if self.latency:
+            time.sleep(self.latency)
+        with Image.open(image_bytes) as img:
+            comment = img.info.get('comment') or b""
+        if isinstance(comment, str):
+            comment = comment.encode()
+        if comment.startswith(PLATE_MARKER):
+            plate = comment[len(PLATE_MARKER):].decode('utf-8').strip()
+        else:
+            plate = self.plates.get(image_digest(image_bytes), self.default)
+        if not plate:
+            return []
+        return [{'lpr': plate, 'conf': 1.0, 'bbox': None}]
+
+class RecordingBackend(LPRBackend):
+    """Wraps another backend and appends every response and its latency to a JSON lines file."""
+
+    name = 'record'
+
+    def __init__(self, backend, path=LPR_REPLAY_PATH):
+        self.backend = backend
+        self.path = path
+        self._lock = threading.Lock()
+
+    def analyze(self, image_bytes):
+        key = image_digest(image_bytes)
+        start = time.perf_counter()
+        result = self.backend.analyze(image_bytes)
+        latency = time.perf_counter() - start
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'latency': latency, 'result': result}) + "\n")
+        return result
+
+class ReplayBackend(LPRBackend):
+    """
+    Plays back responses captured by RecordingBackend with their original latency.
+
+    Frames that were not recorded get a recording chosen deterministically from
+    their hash, so arbitrary test frames still produce realistic responses.
+    """
+
+    name = 'replay'
+
+    def __init__(self, path=LPR_REPLAY_PATH):
+        self.records = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records[record['key']] = record
+        if not self.records:
+            raise RuntimeError(f"No recordings found in '{path}'.")
+        self._ordered = [self.records[key] for key in sorted(self.records)]
+        logger.info(f"Loaded {len(self.records)} LPR recordings from '{path}'.")
+
+    def analyze(self, image_bytes):
+        key = image_digest(image_bytes)
+        record = self.records.get(key) or self._ordered[int(key, 16) % len(self._ordered)]
+        time.sleep(record['latency'])
+        return record['result']
+
+def create_backend(name=LPR_BACKEND):
+    """Build the recognizer backend selected by name."""
+    if name == 'aift':
+        return AiftBackend()
+    if name == 'stub':
+        return StubBackend()
+    if name == 'record':
+        return RecordingBackend(AiftBackend())
+    if name == 'replay':
+        return ReplayBackend()
+    raise ValueError(f"Unknown LPR backend '{name}'.")
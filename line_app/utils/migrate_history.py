@@ -0,0 +1,82 @@
+import argparse
+from datetime import datetime
+from pymongo import UpdateOne, ASCENDING
+from utils.mongodb import get_mongo_client, to_utc, GATE_TIMEZONE, logger
+
+# Format the history times were stored in before they became BSON datetimes
+LEGACY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _legacy_query(after_id=None):
+    query = {'$or': [{'inbound': {'$type': 'string'}}, {'outbound': {'$type': 'string'}}]}
+    if after_id is not None:
+        query['_id'] = {'$gt': after_id}
+    return query
+
+def _parse(value):
+    """Parse a legacy gate-local time string into a UTC datetime; other values pass through."""
+    if isinstance(value, str):
+        return to_utc(datetime.strptime(value, LEGACY_TIME_FORMAT))
+    return value
+
+def convert(doc):
+    """Return the `$set` fields that bring one legacy history document to the datetime schema."""
+    inbound = _parse(doc.get('inbound'))
+    outbound = _parse(doc.get('outbound'))
+    fields = {'inbound': inbound, 'outbound': outbound, 'tz': doc.get('tz', GATE_TIMEZONE)}
+    if isinstance(inbound, datetime) and isinstance(outbound, datetime):
+        fields['duration_s'] = int((outbound - inbound).total_seconds())
+    return fields
+
+def migrate(batch_size=1000, dry_run=False):
+    """
+    Convert string `inbound`/`outbound` times in parking_history to UTC datetimes.
+
+    Documents are walked in `_id` order and written back with one unordered
+    bulk write per batch, so the migration can be stopped and re-run at any
+    point; documents already converted are not matched again.
+
+    Args:
+        batch_size (int): Documents per bulk write.
+        dry_run (bool): Count and convert without writing.
+
+    Returns:
+        dict: Numbers of documents `scanned`, `modified` and `failed`.
+    """
+    db = get_mongo_client().db
+    report = {'scanned': 0, 'modified': 0, 'failed': 0}
+    last_id = None
+    while True:
+        batch = list(
+            db.parking_history.find(_legacy_query(last_id), {'inbound': 1, 'outbound': 1, 'tz': 1})
+            .sort('_id', ASCENDING)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        requests = []
+        for doc in batch:
+            try:
+                requests.append(UpdateOne({'_id': doc['_id']}, {'$set': convert(doc)}))
+            except ValueError as e:
+                report['failed'] += 1
+                logger.error(f"Cannot migrate parking history {doc['_id']}: {e}")
+        report['scanned'] += len(batch)
+        if requests and not dry_run:
+            result = db.parking_history.bulk_write(requests, ordered=False)
+            report['modified'] += result.modified_count
+        logger.info(f"Parking history migration: {report}")
+    return report
+
+def main(argv=None):
+    # Run from line_app/ as: python -m utils.migrate_history [--batch-size N] [--dry-run]
+    parser = argparse.ArgumentParser(description="Convert parking history time strings to BSON datetimes.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Documents per bulk write.")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be converted without writing.")
+    args = parser.parse_args(argv)
+
+    report = migrate(batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"Scanned {report['scanned']}, modified {report['modified']}, failed {report['failed']}.")
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
 import os
-from pymongo import MongoClient
+import re
+import json
+import base64
+import atexit
+import threading
+from pymongo import MongoClient, monitoring, ASCENDING, DESCENDING, ReturnDocument, InsertOne, DeleteOne, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError, BulkWriteError
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash
 import logging
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timezone
 import pytz
+from utils.cache import TTLCache
+from utils.per_process import per_process
 
 load_dotenv()
 
@@ -23,9 +31,259 @@ user = os.getenv("MONGO_INITDB_ROOT_USERNAME")
 passwd = os.getenv("MONGO_INITDB_ROOT_PASSWORD")
 port = 27017
 
+# Connection pool settings of the shared client
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 2))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+
+# Documents per round trip when a page is streamed from a cursor
+MONGO_STREAM_BATCH_SIZE = int(os.getenv("MONGO_STREAM_BATCH_SIZE", 200))
+
+# Operations per bulk_write call of imports
+MONGO_BULK_BATCH_SIZE = int(os.getenv("MONGO_BULK_BATCH_SIZE", 500))
+
+# Parking history times are stored as UTC datetimes; this is the zone they are shown in
+GATE_TIMEZONE = os.getenv("GATE_TIMEZONE", "Asia/Bangkok")
+gate_tz = pytz.timezone(GATE_TIMEZONE)
+
+# Parking lot served by this deployment; occupancy counters are kept per lot and per entry gate
+OCCUPANCY_LOT = os.getenv("OCCUPANCY_LOT", "main")
+
+# Users resolved by LINE id for the bot; an entry is dropped whenever its user document is written
+LINE_USER_CACHE_SIZE = int(os.getenv("LINE_USER_CACHE_SIZE", 1024))
+LINE_USER_CACHE_TTL = float(os.getenv("LINE_USER_CACHE_TTL", 300))
+line_user_cache = TTLCache(maxsize=LINE_USER_CACHE_SIZE, ttl=LINE_USER_CACHE_TTL)
+
+# Users loaded by id for Flask-Login; kept briefly since another process may write the user too
+LOGIN_USER_CACHE_SIZE = int(os.getenv("LOGIN_USER_CACHE_SIZE", 1024))
+LOGIN_USER_CACHE_TTL = float(os.getenv("LOGIN_USER_CACHE_TTL", 30))
+login_user_cache = TTLCache(maxsize=LOGIN_USER_CACHE_SIZE, ttl=LOGIN_USER_CACHE_TTL)
+
+# Bumped whenever this process writes a user; cached copies of an older version are stale
+_user_versions = {}
+_user_versions_lock = threading.Lock()
+
+# Called with (user_ids, plates) whenever this process writes users or license plates
+_write_listeners = []
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collects connection pool statistics for the shared client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_total_s = 0.0
+            self.wait_max_s = 0.0
+            self.pool_clears = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_connections': self.open,
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'avg_wait_ms': round(self.wait_total_s / self.checkouts * 1000, 3) if self.checkouts else 0,
+                'max_wait_ms': round(self.wait_max_s * 1000, 3),
+                'pool_clears': self.pool_clears,
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        duration = getattr(event, 'duration', None) or 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_total_s += duration
+            self.wait_max_s = max(self.wait_max_s, duration)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+pool_stats = PoolStatsListener()
+
+@per_process
 def get_mongo_client():
-    """Reusable MongoClient connection."""
-    return MongoClient(f"mongodb://{user}:{passwd}@{host}:{port}")
+    """Return the process-wide MongoClient, creating it on first use."""
+    pool_stats.reset()
+    client = MongoClient(
+        f"mongodb://{user}:{passwd}@{host}:{port}",
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[pool_stats],
+    )
+    logger.info(f"MongoClient created for process {os.getpid()} (maxPoolSize={MONGO_MAX_POOL_SIZE}).")
+    return client
+
+def close_mongo_client():
+    """Close the shared MongoClient of this process."""
+    client = get_mongo_client.clear()
+    if client is not None:
+        client.close()
+        logger.info("MongoClient closed.")
+
+atexit.register(close_mongo_client)
+
+def mongo_pool_stats():
+    """Return connection pool statistics of the shared MongoClient."""
+    stats = pool_stats.stats()
+    stats['max_pool_size'] = MONGO_MAX_POOL_SIZE
+    stats['pid'] = os.getpid()
+    return stats
+
+# --- INDEX FUNCTIONS ---
+
+# Indexes backing the hot queries, by collection: (keys, options)
+INDEXES = {
+    'license_plates': [
+        ([('plate', ASCENDING)], {'name': 'plate_unique', 'unique': True}),
+        ([('user_id', ASCENDING)], {'name': 'user_id'}),
+    ],
+    'users': [
+        ([('username', ASCENDING)], {'name': 'username_unique', 'unique': True}),
+        ([('is_admin', ASCENDING), ('username', ASCENDING)], {'name': 'is_admin_username'}),
+        # Web-registered users have an empty LINE id, so only non-empty ids must be unique
+        ([('line', ASCENDING)], {'name': 'line_unique', 'unique': True, 'partialFilterExpression': {'line': {'$gt': ''}}}),
+    ],
+    'parking_history': [
+        ([('plate', ASCENDING), ('outbound', ASCENDING)], {'name': 'plate_outbound'}),
+        # Occupancy reconciliation groups the open sessions by entry gate
+        ([('outbound', ASCENDING), ('gate', ASCENDING)], {'name': 'outbound_gate'}),
+        # Keyset pagination of the history page, newest first, optionally by plate prefix
+        ([('inbound', DESCENDING), ('_id', DESCENDING)], {'name': 'inbound_id'}),
+        ([('plate', ASCENDING), ('inbound', DESCENDING), ('_id', DESCENDING)], {'name': 'plate_inbound_id'}),
+    ],
+    'imgs': [
+        ([('uuid', ASCENDING)], {'name': 'uuid'}),
+    ],
+}
+
+# Hot queries that must be served by an index: (name, collection, filter, projection)
+HOT_QUERIES = [
+    ('plate lookup', 'license_plates', {'plate': 'HOT-QUERY-CHECK'}, None),
+    ('plates by user', 'license_plates', {'user_id': 'HOT-QUERY-CHECK'}, None),
+    ('user by LINE id', 'users', {'line': 'HOT-QUERY-CHECK'}, None),
+    ('user by username', 'users', {'username': 'HOT-QUERY-CHECK'}, None),
+    ('open parking session', 'parking_history', {'plate': 'HOT-QUERY-CHECK', 'outbound': None}, None),
+    ('image by uuid', 'imgs', {'uuid': 'HOT-QUERY-CHECK'}, None),
+    ('open sessions', 'parking_history', {'outbound': None}, {'gate': 1, '_id': 0}),
+    ('history by plate prefix', 'parking_history', {'plate': {'$regex': '^HOT-QUERY-CHECK'}}, None),
+    ('history by time range', 'parking_history', {'inbound': {'$gte': datetime(2000, 1, 1), '$lt': datetime(2000, 1, 2)}}, None),
+]
+
+def ensure_indexes():
+    """Create any missing index from INDEXES. Returns a report of index name -> status."""
+    report = {}
+    try:
+        db = get_mongo_client().db
+        for collection, indexes in INDEXES.items():
+            for keys, options in indexes:
+                name = f"{collection}.{options['name']}"
+                try:
+                    db[collection].create_index(keys, **options)
+                    report[name] = 'ok'
+                except OperationFailure as e:
+                    # Typically duplicates blocking a unique index, or an index with the same name but other options
+                    logger.error(f"Error creating index {name}: {e}")
+                    report[name] = f"error: {e}"
+        logger.info(f"Index bootstrap finished: {report}")
+    except Exception as e:
+        logger.error(f"Error bootstrapping indexes: {e}")
+    return report
+
+def verify_indexes():
+    """Compare the indexes present in the database with INDEXES."""
+    report = {}
+    db = get_mongo_client().db
+    for collection, indexes in INDEXES.items():
+        existing = db[collection].index_information()
+        for keys, options in indexes:
+            name = f"{collection}.{options['name']}"
+            info = existing.get(options['name'])
+            if info is None:
+                report[name] = 'missing'
+            elif [tuple(k) for k in info['key']] != keys or bool(info.get('unique')) != bool(options.get('unique')):
+                report[name] = 'mismatch'
+            else:
+                report[name] = 'ok'
+    return report
+
+def _plan_stages(plan):
+    """Yield every stage of an explain() query plan tree."""
+    stack = [plan]
+    while stack:
+        stage = stack.pop()
+        yield stage
+        stack.extend(stage.get('inputStages', []))
+        if 'inputStage' in stage:
+            stack.append(stage['inputStage'])
+        if 'queryPlan' in stage:
+            stack.append(stage['queryPlan'])
+
+def explain_hot_queries():
+    """Run explain() on HOT_QUERIES and report whether each one is served by an index."""
+    report = []
+    db = get_mongo_client().db
+    for name, collection, query, projection in HOT_QUERIES:
+        try:
+            plan = db[collection].find(query, projection).explain()['queryPlanner']['winningPlan']
+            stages = list(_plan_stages(plan))
+            index_names = [stage['indexName'] for stage in stages if 'indexName' in stage]
+            report.append({
+                'query': name,
+                'collection': collection,
+                'uses_index': bool(index_names) and not any(stage.get('stage') == 'COLLSCAN' for stage in stages),
+                'index': index_names[0] if index_names else None,
+                'covered': bool(index_names) and not any(stage.get('stage') == 'FETCH' for stage in stages),
+            })
+        except Exception as e:
+            logger.error(f"Error explaining hot query '{name}': {e}")
+            report.append({'query': name, 'collection': collection, 'uses_index': False, 'error': str(e)})
+    for entry in report:
+        if not entry['uses_index']:
+            logger.warning(f"Hot query '{entry['query']}' on {entry['collection']} is not served by an index.")
+    return report
 
 # --- ADMIN FUNCTIONS ---
 
@@ -102,13 +360,51 @@ def mongo_user_find_uname(username):
         logger.error(f"Error querying user by username: {e}")
         return None
 
+def user_version(user_id):
+    """Return the version of a user as seen by this process."""
+    return _user_versions.get(str(user_id), 0)
+
+def on_write(listener):
+    """Call `listener(user_ids, plates)` whenever this process writes users or license plates."""
+    _write_listeners.append(listener)
+
+def _notify_write(user_ids=(), plates=()):
+    for listener in _write_listeners:
+        try:
+            listener(list(user_ids), list(plates))
+        except Exception as e:
+            logger.error(f"Error in write listener: {e}")
+
+def invalidate_user(user_id, *lines):
+    """Drop the cached copies of a user after it was written, by id and by LINE ids."""
+    user_id = str(user_id)
+    with _user_versions_lock:
+        _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
+    login_user_cache.delete(user_id)
+    for line in lines:
+        if line:
+            line_user_cache.delete(line)
+    _notify_write(user_ids=[user_id])
+
+def invalidate_plates(*plates):
+    """Drop the cached copies of license plates after they were written."""
+    plates = [plate for plate in plates if plate]
+    if plates:
+        _notify_write(plates=plates)
+
 def mongo_user_find_line(line):
-    """Find a user document by username."""
+    """Find a user document (without password) by LINE id, from `line_user_cache` when possible."""
+    doc = line_user_cache.get(line)
+    if doc is not None:
+        return doc
     try:
         mongoClient = get_mongo_client()
         db = mongoClient.db
-        doc = db.users.find_one({"line": line})
+        # The bot never checks passwords, so the hash is kept out of the cache
+        doc = db.users.find_one({"line": line}, {"password": 0})
         logger.info(f"Queried user with line: {line}")
+        if doc and line:
+            line_user_cache.set(line, doc)
         return doc
     except Exception as e:
         logger.error(f"Error querying user by line: {e}")
@@ -141,6 +437,18 @@ def mongo_user_find():
         logger.error(f"Error querying all users: {e}")
         return []
 
+def mongo_user_is_admin(user_id):
+    """Read only the admin flag of a user; False if the user does not exist."""
+    try:
+        db = get_mongo_client().db
+        if isinstance(user_id, str) and ObjectId.is_valid(user_id):
+            user_id = ObjectId(user_id)
+        doc = db.users.find_one({'_id': user_id}, {'is_admin': 1})
+        return bool(doc and doc.get('is_admin'))
+    except Exception as e:
+        logger.error(f"Error querying admin flag of user {user_id}: {e}")
+        return False
+
 def update_user_by_id(user_id, user_data):
     """Update a user document by MongoDB ID."""
     try:
@@ -149,8 +457,9 @@ def update_user_by_id(user_id, user_data):
         # Convert user_id to ObjectId if necessary
         if isinstance(user_id, str) and ObjectId.is_valid(user_id):
             user_id = ObjectId(user_id)
-        result = db.users.update_one({'_id': user_id}, {"$set": user_data})
-        if result.modified_count > 0:
+        before = db.users.find_one_and_update({'_id': user_id}, {"$set": user_data}, projection={'line': 1})
+        if before:
+            invalidate_user(user_id, before.get('line'), user_data.get('line'))
             logger.info(f"User with ID {user_id} updated successfully.")
         else:
             logger.warning(f"No changes made to user with ID {user_id}.")
@@ -167,8 +476,9 @@ def delete_user_by_id(user_id):
             user_id = ObjectId(user_id)
 
         # Delete the user
-        user_result = db.users.delete_one({'_id': user_id})
-        if user_result.deleted_count > 0:
+        deleted = db.users.find_one_and_delete({'_id': user_id}, projection={'line': 1})
+        if deleted:
+            invalidate_user(user_id, deleted.get('line'))
             logger.info(f"User with ID {user_id} deleted successfully.")
 
             # Delete associated license plates
@@ -178,27 +488,122 @@ def delete_user_by_id(user_id):
             logger.warning(f"User with ID {user_id} not found.")
     except Exception as e:
         logger.error(f"Error deleting user and associated license plates by ID: {e}")
-        
-def get_users_with_license_plates():
-    """Fetch users and map their license plates."""
-    mongoClient = get_mongo_client()
-    db = mongoClient.db
-
-    # Query users
-    users = list(db.users.find())
-
-    # Query license plates and group them by user_id
-    license_plates = db.license_plates.aggregate([
-        {"$group": {"_id": "$user_id", "plates": {"$push": "$plate"}}}
-    ])
-    license_plate_map = {item["_id"]: item["plates"] for item in license_plates}
 
-    # Attach license plates to users
-    for user in users:
-        user_id = str(user["_id"])  # Convert ObjectId to string for matching
-        user["license_plates"] = license_plate_map.get(user_id, [])
+# --- DASHBOARD FUNCTIONS ---
+
+class CursorPage:
+    """One page of documents streamed from a cursor asked for `limit + 1`; `has_next` and `next_cursor` are known once iterated."""
+
+    def __init__(self, cursor, limit, cursor_of=None, label='documents'):
+        self._cursor = cursor
+        self.limit = limit
+        self.cursor_of = cursor_of
+        self.label = label
+        self.count = 0
+        self.last = None
+        self.has_next = False
+
+    def __iter__(self):
+        if self._cursor is None:
+            return
+        try:
+            for doc in self._cursor:
+                if self.count == self.limit:
+                    self.has_next = True
+                    break
+                self.count += 1
+                self.last = doc
+                yield doc
+        except Exception as e:
+            # The response may already be on its way; end the page rather than the stream
+            logger.error(f"Error reading {self.label}: {e}")
+        finally:
+            self._cursor.close()
+        logger.info(f"Retrieved {self.count} {self.label}.")
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or self.cursor_of is None or self.last is None:
+            return None
+        return self.cursor_of(self.last)
+
+# Sortable columns of the admin tables; `_id` breaks ties so pages are stable
+DASHBOARD_USER_SORTS = ('username', 'limit', 'is_admin')
+DASHBOARD_PLATE_SORTS = ('plate', 'status')
+
+def _page_stages(page, per_page, sort, direction):
+    # One extra document tells whether a next page exists
+    return [
+        {'$sort': {sort: direction, '_id': direction}},
+        {'$skip': (page - 1) * per_page},
+        {'$limit': per_page + 1},
+    ]
+
+def dashboard_users_page(page=1, per_page=50, sort='username', direction=ASCENDING, username_prefix=None, is_admin=None):
+    """Retrieve one page of users with their license plates, joined after paging, as a CursorPage."""
+    try:
+        db = get_mongo_client().db
+        match = {}
+        if username_prefix:
+            match['username'] = {'$regex': f"^{re.escape(username_prefix)}"}
+        if is_admin is not None:
+            match['is_admin'] = True if is_admin else {'$ne': True}
+        if sort not in DASHBOARD_USER_SORTS:
+            sort = 'username'
+        pipeline = [{'$match': match}] + _page_stages(page, per_page, sort, direction) + [
+            {'$addFields': {'user_key': {'$toString': '$_id'}}},
+            {'$lookup': {
+                'from': 'license_plates',
+                'localField': 'user_key',
+                'foreignField': 'user_id',
+                'as': 'plates',
+            }},
+            {'$project': {
+                'username': 1,
+                'is_admin': 1,
+                'limit': 1,
+                'has_password': {'$gt': [{'$strLenCP': {'$ifNull': ['$password', '']}}, 0]},
+                'license_plates': '$plates.plate',
+            }},
+        ]
+        cursor = db.users.aggregate(pipeline, batchSize=min(per_page + 1, MONGO_STREAM_BATCH_SIZE))
+        return CursorPage(cursor, per_page, label=f"users for dashboard page {page}")
+    except Exception as e:
+        logger.error(f"Error retrieving dashboard users: {e}")
+        return CursorPage(None, per_page)
 
-    return users
+def dashboard_plates_page(page=1, per_page=50, sort='plate', direction=ASCENDING, plate_prefix=None, status=None):
+    """Retrieve one page of license plates with their owner's username, as a CursorPage."""
+    try:
+        db = get_mongo_client().db
+        match = {}
+        if plate_prefix:
+            match['plate'] = {'$regex': f"^{re.escape(plate_prefix)}"}
+        if status is not None:
+            match['status'] = True if status else {'$ne': True}
+        if sort not in DASHBOARD_PLATE_SORTS:
+            sort = 'plate'
+        pipeline = [{'$match': match}] + _page_stages(page, per_page, sort, direction) + [
+            # Plates written by older code may hold a malformed id; those simply have no owner
+            {'$addFields': {'owner_id': {'$convert': {'input': '$user_id', 'to': 'objectId', 'onError': None, 'onNull': None}}}},
+            {'$lookup': {
+                'from': 'users',
+                'localField': 'owner_id',
+                'foreignField': '_id',
+                'pipeline': [{'$project': {'_id': 0, 'username': 1}}],
+                'as': 'owner',
+            }},
+            {'$project': {
+                'plate': 1,
+                'status': 1,
+                'user_data': {'$ifNull': [{'$first': '$owner'}, {}]},
+            }},
+        ]
+        cursor = db.license_plates.aggregate(pipeline, batchSize=min(per_page + 1, MONGO_STREAM_BATCH_SIZE))
+        return CursorPage(cursor, per_page, label=f"license plates for dashboard page {page}")
+    except Exception as e:
+        logger.error(f"Error retrieving dashboard license plates: {e}")
+        return CursorPage(None, per_page)
 
 # --- LICENSE PLATE FUNCTIONS ---
 
@@ -241,6 +646,7 @@ def mongo_license_plate_insert(plate_data):
     try:
         db = mongoClient.db
         result = db.license_plates.insert_one(plate_data)
+        invalidate_plates(plate_data.get('plate'))
         logger.info(f"License plate inserted with ID: {result.inserted_id}")
         logger.debug(f"Inserted license plate data: {plate_data}")
         return result.inserted_id
@@ -258,6 +664,7 @@ def mongo_license_plate_delete(plate, user_id=None):
             query["user_id"] = user_id  # Add user_id to query for precise matching
         result = db.license_plates.delete_one(query)
         if result.deleted_count > 0:
+            invalidate_plates(plate)
             logger.info(f"License plate '{plate}' deleted successfully.")
             return True
         else:
@@ -267,91 +674,310 @@ def mongo_license_plate_delete(plate, user_id=None):
         logger.error(f"Error deleting license plate: {e}")
         return False
 
-def mongo_license_plate_update_status(plate_number, status):
-    """Update the status of a license plate."""
-    mongoClient = get_mongo_client()
-    try:
-        db = mongoClient.db
-        result = db.license_plates.update_one(
-            {"plate": plate_number},
-            {"$set": {"status": status}}
-        )
-        if result.modified_count > 0:
-            logger.info(f"Status of license plate '{plate_number}' updated to {status}")
-            return True
-        else:
-            logger.warning(f"No matching document found for license plate '{plate_number}'")
-            return False
-    except Exception as e:
-        logger.error(f"Error updating license plate status: {e}")
-        return False
-
-def get_plates_with_user_data():
-    """Retrieve all license plates with their associated user data."""
-    mongoClient = get_mongo_client()
-    db = mongoClient.db
-
-    # Query license plates
-    plates = list(db.license_plates.find())
+# --- BULK FUNCTIONS ---
 
-    # Query users and map their data
-    users = db.users.find()
-    user_map = {str(user["_id"]): user for user in users}
+def _write_error_message(error):
+    if error.get('code') == 11000:
+        key = ', '.join(f"{field} '{value}'" for field, value in (error.get('keyValue') or {}).items())
+        return f"Duplicate {key}" if key else "Duplicate key"
+    return error.get('errmsg', 'Write failed')
 
-    # Attach user data to license plates
-    for plate in plates:
-        user_id = str(plate.get("user_id"))
-        user_data = user_map.get(user_id, {})
-        plate["user_data"] = user_data
+# Error of the rows and plates an ordered import never wrote because it stopped earlier
+NOT_ATTEMPTED = "Not attempted: the import stopped at an earlier error"
 
-    return plates
-
-# --- PARKING FUNCTIONS ---
-
-def mongo_parking_history():
-    """Retrieve all parking history documents."""
+def _bulk_write(collection, requests, ordered):
+    """Run one bulk write and return {request index: error message} for the requests that failed."""
     try:
-        mongoClient = get_mongo_client()
-        db = mongoClient.db
-        history = list(db.parking_history.find())
-        logger.info(f"Retrieved {len(history)} parking history documents.")
-        return history
-    except Exception as e:
-        logger.error(f"Error retrieving parking history: {e}")
-        return []
+        collection.bulk_write(requests, ordered=ordered)
+        return {}
+    except BulkWriteError as e:
+        return {error['index']: _write_error_message(error) for error in e.details.get('writeErrors', [])}
+
+def _not_attempted(errors, ordered):
+    """Index past which an ordered write attempted nothing, since it stops at its first error."""
+    return min(errors) if ordered and errors else None
+
+def mongo_bulk_import_users(rows, ordered=False, batch_size=MONGO_BULK_BATCH_SIZE):
+    """Insert users and their license plates in batches of two bulk writes; returns one report per row."""
+    db = get_mongo_client().db
+    reports = [
+        {'username': row['username'], 'status': 'skipped', 'error': None, 'plates': [], 'plate_errors': []}
+        for row in rows
+    ]
+    stopped = False
+    for start in range(0, len(rows), batch_size):
+        if stopped:
+            break
+        batch = rows[start:start + batch_size]
+        users = []
+        for row in batch:
+            user = {key: value for key, value in row.items() if key != 'plates'}
+            user['_id'] = ObjectId()
+            users.append(user)
+        user_errors = _bulk_write(db.users, [InsertOne(user) for user in users], ordered)
+        user_stop = _not_attempted(user_errors, ordered)
+
+        plate_requests, plate_rows = [], []
+        for offset, (row, user) in enumerate(zip(batch, users)):
+            report = reports[start + offset]
+            if offset in user_errors:
+                report['status'], report['error'] = 'failed', user_errors[offset]
+                continue
+            if user_stop is not None and offset > user_stop:
+                continue
+            report['status'] = 'created'
+            for plate in row.get('plates', []):
+                plate_requests.append(InsertOne({'user_id': str(user['_id']), 'plate': plate, 'status': False}))
+                plate_rows.append((report, plate))
+        plate_errors = _bulk_write(db.license_plates, plate_requests, ordered) if plate_requests else {}
+        plate_stop = _not_attempted(plate_errors, ordered)
+        for index, (report, plate) in enumerate(plate_rows):
+            if index in plate_errors:
+                report['plate_errors'].append({'plate': plate, 'error': plate_errors[index]})
+            elif plate_stop is not None and index > plate_stop:
+                report['plate_errors'].append({'plate': plate, 'error': NOT_ATTEMPTED})
+            else:
+                report['plates'].append(plate)
+        invalidate_plates(*(plate for report, plate in plate_rows))
+        stopped = ordered and bool(user_errors or plate_errors)
+
+    for report in reports:
+        if report['status'] == 'skipped':
+            report['error'] = NOT_ATTEMPTED
+    created = sum(1 for report in reports if report['status'] == 'created')
+    logger.info(f"Bulk import: {created} of {len(rows)} users created.")
+    return reports
+
+def mongo_sync_user_plates(user_id, plates):
+    """Make a user's plates match `plates` in one bulk write, keeping parked plates; returns added, removed and errors."""
+    db = get_mongo_client().db
+    user_id = str(user_id)
+    desired = list(dict.fromkeys(plates))
+    current = {doc['plate']: doc for doc in db.license_plates.find({'user_id': user_id}, {'plate': 1, 'status': 1})}
+    report = {'added': [], 'removed': [], 'errors': []}
+
+    requests, changes = [], []
+    for plate, doc in current.items():
+        if plate in desired:
+            continue
+        if doc.get('status'):
+            report['errors'].append({'plate': plate, 'error': "Parked; check it out before removing it"})
+            continue
+        requests.append(DeleteOne({'_id': doc['_id'], 'status': {'$ne': True}}))
+        changes.append(('removed', plate))
+    for plate in desired:
+        if plate not in current:
+            requests.append(InsertOne({'user_id': user_id, 'plate': plate, 'status': False}))
+            changes.append(('added', plate))
+
+    if requests:
+        errors = _bulk_write(db.license_plates, requests, ordered=False)
+        for index, (change, plate) in enumerate(changes):
+            if index in errors:
+                report['errors'].append({'plate': plate, 'error': errors[index]})
+            else:
+                report[change].append(plate)
+        invalidate_plates(*(plate for change, plate in changes))
+    logger.info(f"Plates of user {user_id} synced: +{len(report['added'])} -{len(report['removed'])}, {len(report['errors'])} errors.")
+    return report
+
+# --- GATE FUNCTIONS ---
+
+_transactions_supported = None
+
+def _supports_transactions(client):
+    """Multi-document transactions need a replica set or a sharded cluster."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = client.admin.command('hello')
+        _transactions_supported = bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+        logger.info(f"MongoDB transactions supported: {_transactions_supported}")
+    return _transactions_supported
+
+def _as_object_id(value):
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+def to_utc(local_time):
+    """Interpret a naive datetime in the gate timezone and return it as UTC."""
+    return gate_tz.localize(local_time).astimezone(timezone.utc)
+
+def to_local(value, tz_name=None):
+    """Convert a stored (naive UTC) datetime to the gate timezone; other values pass through."""
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    tz = gate_tz if tz_name in (None, GATE_TIMEZONE) else pytz.timezone(tz_name)
+    return value.astimezone(tz)
+
+def _history_inbound_doc(plate_number, gate=None):
+    return {"plate": plate_number, "inbound": utc_now(), "outbound": None, "tz": GATE_TIMEZONE, "gate": gate}
+
+def occupancy_counter_ids(gate=None, lot=OCCUPANCY_LOT):
+    """Ids of the counters touched by a session: the lot and, when known, its entry gate."""
+    ids = [f"lot:{lot}"]
+    if gate:
+        ids.append(f"gate:{lot}:{gate}")
+    return ids
+
+def _occupancy_inc(db, gate, delta, session=None):
+    # The lot and gate counters move in one round trip
+    now = utc_now()
+    requests = []
+    for counter_id in occupancy_counter_ids(gate):
+        kind = counter_id.split(':', 1)[0]
+        requests.append(UpdateOne(
+            {'_id': counter_id},
+            {'$inc': {'count': delta}, '$set': {'updated_at': now},
+             '$setOnInsert': {'kind': kind, 'lot': OCCUPANCY_LOT, 'gate': gate if kind == 'gate' else None}},
+            upsert=True
+        ))
+    db.occupancy.bulk_write(requests, ordered=False, session=session)
+
+def _history_outbound_update():
+    # Pipeline update so the duration is computed from the stored inbound in the same write;
+    # sessions still holding a string inbound (not yet migrated) get no duration
+    now = utc_now()
+    return [{"$set": {
+        "outbound": now,
+        "duration_s": {"$cond": [
+            {"$eq": [{"$type": "$inbound"}, "date"]},
+            {"$toLong": {"$divide": [{"$subtract": [now, "$inbound"]}, 1000]}},
+            None,
+        ]},
+    }}]
+
+def _gate_transition(db, plate_number, status, session=None, gate=None):
+    # Flip the plate only if it is not already in the requested state; this is what
+    # stops two frames or two gates from both checking the same car in or out
+    plate = db.license_plates.find_one_and_update(
+        {'plate': plate_number, 'status': {'$ne': status}},
+        {'$set': {'status': status}},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if plate is None:
+        exists = db.license_plates.find_one({'plate': plate_number}, {'_id': 1}, session=session)
+        return {'result': 'unchanged' if exists else 'not_found', 'plate': None, 'user': None}
+
+    # Take or return one unit of quota; entry is only allowed while the limit is positive
+    user_id = _as_object_id(plate.get('user_id'))
+    user_filter = {'_id': user_id}
+    if status:
+        user_filter['limit'] = {'$gt': 0}
+    user = db.users.find_one_and_update(
+        user_filter,
+        {'$inc': {'limit': -1 if status else 1}},
+        projection={'password': 0},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if user is None:
+        if session is None:
+            # No transaction to roll back: undo the plate flip
+            db.license_plates.update_one({'_id': plate['_id'], 'status': status}, {'$set': {'status': not status}})
+        exists = db.users.find_one({'_id': user_id}, {'_id': 1}, session=session)
+        return {'result': 'no_limit' if exists else 'no_user', 'plate': plate, 'user': None}
+
+    # Open or close the parking history record and move the occupancy counters with it
+    if status:
+        db.parking_history.insert_one(_history_inbound_doc(plate_number, gate), session=session)
+        _occupancy_inc(db, gate, 1, session)
+    else:
+        closed = db.parking_history.find_one_and_update(
+            {"plate": plate_number, "outbound": None},
+            _history_outbound_update(),
+            projection={'gate': 1},
+            session=session
+        )
+        if closed is not None:
+            # Counted against the gate the car came in through
+            _occupancy_inc(db, closed.get('gate'), -1, session)
+    return {'result': 'ok', 'plate': plate, 'user': user}
 
-def mongo_parking_inbound(plate_number):
-    """Insert a new parking history document."""
+def mongo_gate_transition(plate_number, status, retries=3, gate=None):
+    """Check a plate in (True) or out (False) atomically; returns {'result', 'plate', 'user'}."""
     try:
-        mongoClient = get_mongo_client()
-        db = mongoClient.db
-        bangkok_tz = pytz.timezone('Asia/Bangkok')
-        bangkok_time = datetime.now(bangkok_tz)
-        readable_time = bangkok_time.strftime('%Y-%m-%d %H:%M:%S')
-        db.parking_history.insert_one(
-            {"plate": plate_number, "inbound": readable_time, "outbound": None}
-        )
-        logger.info(f"Inbound timestamp inserted for plate: {plate_number}")
+        client = get_mongo_client()
+        db = client.db
+        if not _supports_transactions(client):
+            outcome = _gate_transition(db, plate_number, status, gate=gate)
+        else:
+            for attempt in range(retries):
+                try:
+                    with client.start_session() as session:
+                        with session.start_transaction():
+                            outcome = _gate_transition(db, plate_number, status, session, gate)
+                            if outcome['result'] != 'ok':
+                                session.abort_transaction()
+                    break
+                except PyMongoError as e:
+                    if not e.has_error_label('TransientTransactionError') or attempt == retries - 1:
+                        raise
+                    logger.warning(f"Retrying gate transition for plate '{plate_number}': {e}")
+        if outcome['user']:
+            # The owner's limit moved
+            invalidate_user(outcome['user']['_id'], outcome['user'].get('line'))
+        logger.info(f"Gate transition for plate '{plate_number}' to {status}: {outcome['result']}")
+        return outcome
     except Exception as e:
-        logger.error(f"Error inserting inbound timestamp: {e}")
+        logger.error(f"Error in gate transition for plate '{plate_number}': {e}")
+        return {'result': 'error', 'plate': None, 'user': None}
+
+# --- PARKING FUNCTIONS ---
 
-def mongo_parking_outbound(plate_number):
-    """Update the outbound timestamp for a parking history document."""
+def encode_history_cursor(doc):
+    """Opaque keyset cursor pointing just past `doc` in newest-first order; legacy string times are kept as strings."""
+    inbound = doc['inbound']
+    if isinstance(inbound, datetime):
+        key = ['d', to_local(inbound, 'UTC').isoformat(), str(doc['_id'])]
+    else:
+        key = ['s', inbound, str(doc['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_history_cursor(cursor):
+    kind, inbound, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if kind == 'd':
+        inbound = datetime.fromisoformat(inbound)
+    return inbound, ObjectId(doc_id)
+
+def mongo_parking_history_page(limit=50, cursor=None, plate_prefix=None, since=None, until=None):
+    """Retrieve one page of parking history, newest inbound first, as a CursorPage."""
     try:
-        mongoClient = get_mongo_client()
-        db = mongoClient.db
-        bangkok_tz = pytz.timezone('Asia/Bangkok')
-        bangkok_time = datetime.now(bangkok_tz)
-        readable_time = bangkok_time.strftime('%Y-%m-%d %H:%M:%S')
-        result = db.parking_history.update_one(
-            {"plate": plate_number, "outbound": None},
-            {"$set": {"outbound": readable_time}}
+        db = get_mongo_client().db
+        query = {}
+        if plate_prefix:
+            # Anchored, case-sensitive prefix so the plate index can be used
+            query['plate'] = {'$regex': f"^{re.escape(plate_prefix)}"}
+        if since or until:
+            query['inbound'] = {}
+            if since:
+                query['inbound']['$gte'] = since
+            if until:
+                query['inbound']['$lt'] = until
+        if cursor:
+            inbound, doc_id = decode_history_cursor(cursor)
+            query['$or'] = [
+                {'inbound': {'$lt': inbound}},
+                {'inbound': inbound, '_id': {'$lt': doc_id}},
+            ]
+            if isinstance(inbound, datetime):
+                # Unmigrated rows keep string times, which sort after every date in descending order
+                query['$or'].append({'inbound': {'$type': 'string'}})
+        cursor = (
+            db.parking_history.find(query)
+            .sort([('inbound', DESCENDING), ('_id', DESCENDING)])
+            .limit(limit + 1)
+            .batch_size(min(limit + 1, MONGO_STREAM_BATCH_SIZE))
         )
-        if result.modified_count > 0:
-            logger.info(f"Outbound timestamp updated for plate: {plate_number}")
-        else:
-            logger.warning(f"No matching document found for outbound update: {plate_number}")
+        return CursorPage(cursor, limit, cursor_of=encode_history_cursor, label='parking history documents')
     except Exception as e:
-        logger.error(f"Error updating outbound timestamp: {e}")
+        logger.error(f"Error retrieving parking history page: {e}")
+        return CursorPage(None, limit)
     
     
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+import json
+import threading
+import logging
+from dotenv import load_dotenv
+from pymongo.errors import PyMongoError, DuplicateKeyError
+from utils.mongodb import get_mongo_client, occupancy_counter_ids, utc_now, to_local, OCCUPANCY_LOT
+from utils.per_process import per_process
+
+load_dotenv()
+
+# Seconds between reconciliations of the counters against parking_history
+OCCUPANCY_RECONCILE_INTERVAL = float(os.getenv('OCCUPANCY_RECONCILE_INTERVAL', 300))
+# Retained MQTT topic carrying the latest occupancy snapshot
+OCCUPANCY_TOPIC = os.getenv('OCCUPANCY_TOPIC', '/occupancy')
+
+logger = logging.getLogger()
+
+def _isoformat(value):
+    return to_local(value, 'UTC').isoformat() if value is not None else None
+
+class Occupancy:
+    """
+    Live occupancy of one lot, read from the counters kept by the gate transitions.
+
+    Every check-in and check-out moves the `occupancy` counters in the same
+    write path as the parking history, so reading them never scans. A
+    background thread periodically recomputes them from the open sessions in
+    `parking_history` to correct any drift (crashes between writes on a
+    standalone server, manual edits).
+    """
+
+    def __init__(self, lot=OCCUPANCY_LOT, interval=OCCUPANCY_RECONCILE_INTERVAL):
+        self.lot = lot
+        self.interval = interval
+        self.publisher = None
+        self.reconciliations = 0
+        self.corrections = 0
+        self.last_reconciled = None
+        self.last_drift = {}
+        self._stop = threading.Event()
+
+    def snapshot(self):
+        """Return the current counts of the lot and of each entry gate."""
+        db = get_mongo_client().db
+        snapshot = {'lot': self.lot, 'count': 0, 'gates': {}, 'updated_at': None,
+                    'reconciled_at': _isoformat(self.last_reconciled)}
+        for counter in db.occupancy.find({'lot': self.lot}):
+            if counter.get('kind') == 'lot':
+                snapshot['count'] = counter.get('count', 0)
+                snapshot['updated_at'] = _isoformat(counter.get('updated_at'))
+            else:
+                snapshot['gates'][counter.get('gate')] = counter.get('count', 0)
+        return snapshot
+
+    def set_publisher(self, publish):
+        """Register `publish(topic, payload)` used to push snapshots to OCCUPANCY_TOPIC."""
+        self.publisher = publish
+
+    def changed(self):
+        """Publish a fresh snapshot after a successful check-in or check-out."""
+        if self.publisher is None:
+            return
+        try:
+            self.publisher(OCCUPANCY_TOPIC, json.dumps(self.snapshot()))
+        except Exception as e:
+            logger.error(f"Error publishing occupancy: {e}")
+
+    def reconcile(self):
+        """
+        Recompute the counters from the open sessions in parking_history.
+
+        Returns:
+            dict: Counter id -> correction applied, for counters that had drifted.
+        """
+        db = get_mongo_client().db
+        # Counters first: a gate transition landing after this read shows up as a count that
+        # no longer matches below, and that counter is left for the next run instead of undone
+        current = {counter['_id']: counter.get('count', 0) for counter in db.occupancy.find({'lot': self.lot})}
+        expected = {counter_id: 0 for counter_id in occupancy_counter_ids(lot=self.lot)}
+        for group in db.parking_history.aggregate([
+            {'$match': {'outbound': None}},
+            {'$group': {'_id': '$gate', 'count': {'$sum': 1}}},
+        ]):
+            for counter_id in occupancy_counter_ids(group['_id'], self.lot):
+                expected[counter_id] = expected.get(counter_id, 0) + group['count']
+        for counter_id in current:
+            expected.setdefault(counter_id, 0)
+
+        drift = {}
+        now = utc_now()
+        for counter_id, count in expected.items():
+            if current.get(counter_id) == count:
+                continue
+            kind, _, name = counter_id.partition(':')
+            gate = name.split(':', 1)[1] if kind == 'gate' else None
+            if counter_id in current:
+                previous = current[counter_id]
+                result = db.occupancy.update_one(
+                    {'_id': counter_id, 'count': previous},
+                    {'$set': {'count': count, 'updated_at': now}}
+                )
+                if not result.matched_count:
+                    continue
+            else:
+                previous = 0
+                try:
+                    db.occupancy.insert_one({'_id': counter_id, 'count': count, 'updated_at': now,
+                                             'kind': kind, 'lot': self.lot, 'gate': gate})
+                except DuplicateKeyError:
+                    continue
+            if previous != count:
+                drift[counter_id] = count - previous
+
+        self.reconciliations += 1
+        self.last_reconciled = now
+        self.last_drift = drift
+        if drift:
+            self.corrections += 1
+            logger.warning(f"Occupancy counters of lot '{self.lot}' corrected: {drift}")
+            self.changed()
+        return drift
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.reconcile()
+            except PyMongoError as e:
+                logger.error(f"Error reconciling occupancy: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='occupancy', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            'lot': self.lot,
+            'reconciliations': self.reconciliations,
+            'corrections': self.corrections,
+            'last_reconciled': _isoformat(self.last_reconciled),
+            'last_drift': self.last_drift,
+        }
+
+@per_process
+def get_occupancy():
+    """Return the process-wide occupancy tracker, starting its reconciler on first use."""
+    occupancy = Occupancy()
+    occupancy.start()
+    return occupancy
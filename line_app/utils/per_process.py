@@ -0,0 +1,51 @@
+import os
+import threading
+import functools
+
+class per_process:
+    """
+    Decorator turning a factory into a getter of one object per process.
+
+    The first call in a process builds the object with `factory()` and later
+    calls return it. Threads, sockets and connection pools do not survive a
+    fork, so a forked child builds its own object on first use instead of
+    inheriting the parent's.
+    """
+
+    def __init__(self, factory):
+        functools.update_wrapper(self, factory)
+        self.factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # The lock may have been held by a parent thread that does not exist in the child
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _current(self):
+        return self._value if self._pid == os.getpid() else None
+
+    def __call__(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._value = self.factory()
+                self._pid = os.getpid()
+            return self._value
+
+    def peek(self):
+        """Return the object of this process without building it; None if it was not built yet."""
+        with self._lock:
+            return self._current()
+
+    def clear(self):
+        """Forget the object of this process, returning it; the next call builds a new one."""
+        with self._lock:
+            value = self._current()
+            self._value = None
+            self._pid = None
+            return value
+
@@ -0,0 +1,66 @@
+import os
+import time
+import logging
+from flask import session
+from dotenv import load_dotenv
+from utils.mongodb import mongo_user_find_id, login_user_cache, user_version
+
+load_dotenv()
+
+# Seconds a session snapshot of the user may stand in for a database lookup
+SESSION_USER_MAX_AGE = float(os.getenv('SESSION_USER_MAX_AGE', 300))
+# Shorter limit for admins, so a demotion made by another process takes effect quickly
+SESSION_ADMIN_MAX_AGE = float(os.getenv('SESSION_ADMIN_MAX_AGE', 30))
+
+# Session key of the snapshot and the user fields it keeps (those the templates show)
+SESSION_USER_KEY = '_user_snapshot'
+SESSION_USER_FIELDS = ('username', 'pic', 'line', 'is_admin', 'limit')
+
+logger = logging.getLogger()
+
+def _from_snapshot(user_id):
+    snapshot = session.get(SESSION_USER_KEY)
+    if not snapshot or snapshot.get('id') != user_id:
+        return None
+    max_age = SESSION_ADMIN_MAX_AGE if snapshot.get('is_admin') else SESSION_USER_MAX_AGE
+    if snapshot.get('version') != user_version(user_id) or time.time() - snapshot.get('at', 0) > max_age:
+        return None
+    return {'_id': user_id, **{field: snapshot.get(field) for field in SESSION_USER_FIELDS}}
+
+def _save_snapshot(user_id, doc):
+    session[SESSION_USER_KEY] = {
+        'id': user_id,
+        'version': user_version(user_id),
+        'at': time.time(),
+        **{field: doc.get(field) for field in SESSION_USER_FIELDS},
+    }
+
+def load_user_doc(user_id):
+    """
+    Resolve the logged-in user for Flask-Login without a database round trip where possible.
+
+    Looks in the in-process `login_user_cache` first, then in the snapshot kept
+    in the session, and only then in MongoDB. A snapshot is used while it is
+    younger than SESSION_USER_MAX_AGE (SESSION_ADMIN_MAX_AGE for admins) and
+    no write to the user happened in this process since it was taken (`update_user_by_id` and `delete_user_by_id`
+    bump the user's version). Documents from the cache or the snapshot carry
+    no password.
+
+    Returns:
+        dict: The user document, or None if the user does not exist.
+    """
+    user_id = str(user_id)
+    doc = login_user_cache.get(user_id)
+    if doc is None:
+        doc = _from_snapshot(user_id)
+        if doc is None:
+            doc = mongo_user_find_id(user_id)
+            if doc is None:
+                session.pop(SESSION_USER_KEY, None)
+                return None
+            doc = {'_id': user_id, **{field: doc.get(field) for field in SESSION_USER_FIELDS}}
+            _save_snapshot(user_id, doc)
+        login_user_cache.set(user_id, doc)
+    elif _from_snapshot(user_id) is None:
+        _save_snapshot(user_id, doc)
+    return doc
@@ -0,0 +1,28 @@
+from pymongo import ASCENDING, DESCENDING
+
+# Rows per page of the admin tables; pages are streamed, so large ones cost time, not memory
+TABLE_PAGE_SIZE = 50
+TABLE_MAX_PAGE_SIZE = 5000
+
+def flag_arg(value):
+    """Map a 'yes'/'no' filter value to True/False; anything else means no filter."""
+    return {'yes': True, 'no': False}.get((value or '').lower())
+
+def table_args(args, sorts):
+    """
+    Read the paging and sorting arguments shared by the admin tables.
+
+    Args:
+        args (MultiDict): `request.args`.
+        sorts (tuple): Sortable columns; the first one is the default.
+
+    Returns:
+        dict: `page`, `per_page`, `sort` and `direction` for the dashboard queries.
+    """
+    sort = args.get('sort', sorts[0])
+    return {
+        'page': max(args.get('page', 1, type=int), 1),
+        'per_page': min(max(args.get('per_page', TABLE_PAGE_SIZE, type=int), 1), TABLE_MAX_PAGE_SIZE),
+        'sort': sort if sort in sorts else sorts[0],
+        'direction': DESCENDING if args.get('dir') == 'desc' else ASCENDING,
+    }
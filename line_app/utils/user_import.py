@@ -0,0 +1,132 @@
+import io
+import re
+import csv
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash
+from utils.mongodb import mongo_bulk_import_users, MONGO_BULK_BATCH_SIZE, NOT_ATTEMPTED
+
+# Password hashing is CPU-bound but releases the GIL, so it is spread over a few threads
+IMPORT_HASH_WORKERS = 4
+
+logger = logging.getLogger()
+
+def parse_upload(filename, data):
+    """
+    Read an uploaded CSV or JSON file into a list of raw rows.
+
+    CSV files need a header row with `username`, `password`, `limit`,
+    `is_admin`, `line` and `plates` columns (only `username` is required);
+    plates are separated by spaces, commas or semicolons. JSON files hold a
+    list of objects with the same keys, where `plates` may also be a list.
+    """
+    text = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json') or text.lstrip().startswith('['):
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError("JSON import must be a list of users.")
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+def _plates(value):
+    if isinstance(value, list):
+        return [str(plate).strip() for plate in value if str(plate).strip()]
+    return [plate for plate in re.split(r'[\s,;]+', str(value or '')) if plate]
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+def validate_row(raw):
+    """Return a clean user row from a raw one, or raise ValueError. Rules match AddUserForm."""
+    if not isinstance(raw, dict):
+        raise ValueError("Row is not an object")
+    username = str(raw.get('username') or '').strip()
+    if not 4 <= len(username) <= 15:
+        raise ValueError("Username must be between 4 and 15 characters")
+    password = str(raw.get('password') or '')
+    line = str(raw.get('line') or '').strip()
+    if not line and not 6 <= len(password) <= 20:
+        raise ValueError("Password must be between 6 and 20 characters")
+    try:
+        limit = int(raw.get('limit') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Limit must be a whole number")
+    if limit < 0:
+        raise ValueError("Limit cannot be negative")
+    plates = _plates(raw.get('plates'))
+    for plate in plates:
+        if len(plate) > 20:
+            raise ValueError(f"Plate '{plate}' is longer than 20 characters")
+    return {
+        'username': username,
+        'password': password,
+        'pic': "",
+        'is_admin': _flag(raw.get('is_admin')),
+        'limit': limit,
+        'line': line,
+        'plates': list(dict.fromkeys(plates)),
+    }
+
+def import_users(raw_rows, ordered=False, batch_size=MONGO_BULK_BATCH_SIZE):
+    """
+    Validate raw rows and write the valid ones with `mongo_bulk_import_users`.
+
+    Rows repeating a username or a plate of an earlier row are rejected before
+    anything is written; clashes with existing users and plates are reported
+    by the bulk write.
+
+    Returns:
+        list: One report per input row, numbered from 1, with `row`, `username`,
+        `status` ('created', 'failed', 'skipped' or 'invalid'), `error`, `plates`
+        and `plate_errors`.
+    """
+    reports = []
+    valid = []
+    usernames, plates = set(), set()
+    for number, raw in enumerate(raw_rows, start=1):
+        try:
+            row = validate_row(raw)
+            if row['username'] in usernames:
+                raise ValueError(f"Username '{row['username']}' appears earlier in the file")
+            repeated = [plate for plate in row['plates'] if plate in plates]
+            if repeated:
+                raise ValueError(f"Plate '{repeated[0]}' appears earlier in the file")
+        except ValueError as e:
+            username = raw.get('username') if isinstance(raw, dict) else None
+            reports.append({'row': number, 'username': username, 'status': 'invalid', 'error': str(e),
+                            'plates': [], 'plate_errors': []})
+            continue
+        usernames.add(row['username'])
+        plates.update(row['plates'])
+        valid.append((number, row))
+
+    if ordered and reports:
+        # An ordered import writes nothing past the first invalid row
+        first_invalid = reports[0]['row']
+        valid = [(number, row) for number, row in valid if number < first_invalid]
+
+    with ThreadPoolExecutor(max_workers=IMPORT_HASH_WORKERS) as executor:
+        hashes = executor.map(
+            lambda row: generate_password_hash(row['password'], method='pbkdf2:sha256') if row['password'] else '',
+            [row for _, row in valid]
+        )
+        for (_, row), password in zip(valid, hashes):
+            row['password'] = password
+
+    written = mongo_bulk_import_users([row for _, row in valid], ordered=ordered, batch_size=batch_size)
+    for (number, _), report in zip(valid, written):
+        reports.append({'row': number, **report})
+
+    # Rows left out of an ordered import after its first invalid row
+    reported = {report['row'] for report in reports}
+    for number, raw in enumerate(raw_rows, start=1):
+        if number not in reported:
+            reports.append({'row': number, 'username': raw.get('username'), 'status': 'skipped',
+                            'error': NOT_ATTEMPTED,
+                            'plates': [], 'plate_errors': []})
+    reports.sort(key=lambda report: report['row'])
+    logger.info(f"User import of {len(raw_rows)} rows: {sum(r['status'] == 'created' for r in reports)} created.")
+    return reports